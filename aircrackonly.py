@@ -1,15 +1,446 @@
 import pwnagotchi.plugins as plugins
 
 import logging
-import subprocess
-import string
+import mmap
+import re
+import struct
 import os
+import json
+import queue
+import threading
+import time
+import multiprocessing
+from flask import jsonify
 
 '''
-Aircrack-ng needed, to install:
-> apt-get install aircrack-ng
+Captures are checked in-process by walking the pcap/pcapng once,
+aircrack-ng is no longer needed.
+
+main.plugins.aircrackonly.workers = 1
+main.plugins.aircrackonly.queue_size = 64
+
+to check every pcap already in the handshakes directory once at startup:
+main.plugins.aircrackonly.backfill = true
+main.plugins.aircrackonly.backfill_workers = 2
+main.plugins.aircrackonly.cache_path = "/root/.aircrackonly_verdicts.json"
+
+to keep only the best N captures of every bssid (full handshake over PMKID, fewer frames over more):
+main.plugins.aircrackonly.keep_per_bssid = 1
 '''
 
+CAPTURE_BSSID = re.compile(r'_([0-9a-fA-F]{12})\.pcap$')
+CAPTURE_STEM = re.compile(r'_[0-9a-fA-F]{12}(?=\.)')
+CACHE_SAVE_INTERVAL = 10
+
+
+class CaptureVerdict:
+    # decoded counts the frames with a usable 802.11 header, eapol the EAPOL-Key frames among them
+    def __init__(self, frames=0, handshakes=0, pmkids=0, message_pairs=None, decoded=0, eapol=0):
+        self.frames = frames
+        self.handshakes = handshakes
+        self.pmkids = pmkids
+        self.message_pairs = message_pairs or []
+        self.decoded = decoded
+        self.eapol = eapol
+
+    @property
+    def crackable(self):
+        return self.handshakes > 0 or self.pmkids > 0
+
+    def to_list(self):
+        return [self.frames, self.handshakes, self.pmkids, self.message_pairs, self.decoded, self.eapol]
+
+    @classmethod
+    def from_list(cls, values):
+        return cls(*values)
+
+    def score(self):
+        # higher is better: complete handshakes first, then more message pairs, PMKIDs, smaller captures
+        return self.handshakes > 0, len(self.message_pairs), self.pmkids > 0, -self.frames
+
+    def __repr__(self):
+        return (f"CaptureVerdict(frames={self.frames}, handshakes={self.handshakes}, "
+                f"pmkids={self.pmkids}, message_pairs={self.message_pairs}, "
+                f"decoded={self.decoded}, eapol={self.eapol})")
+
+
+# --- shared capture reader --------------------------------------------------------------------
+# plugins are single files, so this block is carried by both aircrackonly.py and uncracked.py.
+# aircrackonly.py holds the canonical copy: change it there and copy the block over byte for byte.
+PCAPNG_SHB = 0x0A0D0D0A
+LLC_EAPOL = b'\xaa\xaa\x03\x00\x00\x00\x88\x8e'
+PMKID_KDE = b'\xdd\x14\x00\x0f\xac\x04'
+FORK_POLL = 5
+FORK_WORKER_DIED = 'worker died'
+
+
+def iter_frames(view):
+    # yields (linktype, frame) slices of a classic pcap or pcapng capture held in bytes or a memoryview
+    if len(view) >= 12 and struct.unpack_from('<I', view, 0)[0] == PCAPNG_SHB:
+        yield from _iter_pcapng_frames(view)
+        return
+    if len(view) < 24:
+        return
+    magic = struct.unpack_from('<I', view, 0)[0]
+    if magic in (0xa1b2c3d4, 0xa1b23c4d):
+        endian = '<'
+    elif magic in (0xd4c3b2a1, 0x4d3cb2a1):
+        endian = '>'
+    else:
+        return
+    linktype = struct.unpack_from(endian + 'I', view, 20)[0] & 0x0fffffff
+    offset = 24
+    while offset + 16 <= len(view):
+        incl_len = struct.unpack_from(endian + 'I', view, offset + 8)[0]
+        start = offset + 16
+        if start + incl_len > len(view):
+            break
+        yield linktype, view[start:start + incl_len]
+        offset = start + incl_len
+
+
+def _iter_pcapng_frames(view):
+    endian = '<'
+    linktypes = []
+    offset = 0
+    while offset + 12 <= len(view):
+        block_type = struct.unpack_from(endian + 'I', view, offset)[0]
+        if block_type == PCAPNG_SHB:
+            endian = '<' if bytes(view[offset + 8:offset + 12]) == b'\x4d\x3c\x2b\x1a' else '>'
+            linktypes = []
+        block_len = struct.unpack_from(endian + 'I', view, offset + 4)[0]
+        if block_len < 12 or offset + block_len > len(view):
+            break
+        if block_type == 1:
+            linktypes.append(struct.unpack_from(endian + 'H', view, offset + 8)[0])
+        elif block_type == 6 and block_len >= 32:
+            interface, = struct.unpack_from(endian + 'I', view, offset + 8)
+            caplen, = struct.unpack_from(endian + 'I', view, offset + 20)
+            if interface < len(linktypes):
+                yield linktypes[interface], view[offset + 28:offset + 28 + min(caplen, block_len - 32)]
+        elif block_type == 3 and linktypes:
+            origlen, = struct.unpack_from(endian + 'I', view, offset + 8)
+            yield linktypes[0], view[offset + 12:offset + 12 + min(origlen, block_len - 16)]
+        offset += block_len
+
+
+def dot11_frame(linktype, frame):
+    # strips radiotap / ppi / prism / avs headers, None for link types without 802.11 frames
+    if linktype in (127, 192):
+        if len(frame) < 4:
+            return None
+        return frame[struct.unpack_from('<H', frame, 2)[0]:]
+    if linktype == 105:
+        return frame
+    if linktype in (119, 163):
+        if len(frame) < 8:
+            return None
+        # some drivers put an avs header behind the prism link type, it starts with its version
+        if linktype == 163 or struct.unpack_from('>I', frame, 0)[0] & 0xfffffff0 == 0x80211000:
+            header_len, = struct.unpack_from('>I', frame, 4)
+        else:
+            # prism msglen is in host byte order
+            header_len, = struct.unpack_from('<I', frame, 4)
+            if header_len > len(frame):
+                header_len, = struct.unpack_from('>I', frame, 4)
+        if header_len > len(frame):
+            return None
+        return frame[header_len:]
+    return None
+
+
+def eapol_key(frame):
+    # (ap, station, key_info, replay_counter, nonce, eapol) of an unprotected EAPOL-Key data frame,
+    # eapol is cut to the length its header declares
+    flags = frame[1]
+    if (frame[0] >> 2) & 0x03 != 2 or flags & 0x40:
+        return None
+    header_len = 24
+    if flags & 0x03 == 0x03:
+        header_len += 6
+    if frame[0] & 0x80:
+        header_len += 2
+        if flags & 0x80:
+            header_len += 4
+    if bytes(frame[header_len:header_len + 8]) != LLC_EAPOL:
+        return None
+    eapol = frame[header_len + 8:]
+    if len(eapol) < 99 or eapol[1] != 3:
+        return None
+    eapol = eapol[:4 + struct.unpack_from('>H', eapol, 2)[0]]
+    if len(eapol) < 99:
+        return None
+    if flags & 0x03 == 0x02:
+        ap, station = bytes(frame[10:16]), bytes(frame[4:10])
+    elif flags & 0x03 == 0x01:
+        ap, station = bytes(frame[4:10]), bytes(frame[10:16])
+    else:
+        return None
+    key_info, = struct.unpack_from('>H', eapol, 5)
+    replay, = struct.unpack_from('>Q', eapol, 9)
+    return ap, station, key_info, replay, bytes(eapol[17:49]), eapol
+
+
+def eapol_message(key_info, nonce):
+    # 1-4 for the message of the 4-way handshake a pairwise EAPOL-Key frame is, None otherwise
+    if not key_info & 0x0008:
+        return None
+    ack, mic, install, secure = key_info & 0x0080, key_info & 0x0100, key_info & 0x0040, key_info & 0x0200
+    if ack and not mic:
+        return 1
+    if ack and mic and install:
+        return 3
+    if mic and not ack and not secure and nonce.strip(b'\x00'):
+        return 2
+    if mic and not ack:
+        return 4
+    return None
+
+
+def eapol_pmkid(eapol):
+    # the PMKID in the key data of an M1, None when it carries none
+    key_data = bytes(eapol[99:99 + struct.unpack_from('>H', eapol, 97)[0]])
+    pos = key_data.find(PMKID_KDE)
+    if pos < 0:
+        return None
+    pmkid = key_data[pos + 6:pos + 22]
+    if len(pmkid) != 16 or not pmkid.strip(b'\x00'):
+        return None
+    return pmkid
+
+
+def _fork_worker(function, tasks, results):
+    for item in iter(tasks.get, None):
+        try:
+            results.put((item, function(item), None))
+        except Exception as e:
+            results.put((item, None, str(e) or type(e).__name__))
+
+
+def fork_map(function, items, workers):
+    # yields (item, result, error) for every item. plugins are loaded without a module name, so
+    # function can not be pickled for a process pool; forked workers already have it. error is
+    # None, the exception text, or FORK_WORKER_DIED for the items left once every worker is gone
+    # (a worker killed mid item, e.g. by the oom killer, never answers)
+    workers = min(workers, len(items))
+    if workers <= 1:
+        for item in items:
+            try:
+                yield item, function(item), None
+            except Exception as e:
+                yield item, None, str(e) or type(e).__name__
+        return
+    context = multiprocessing.get_context('fork')
+    tasks, results = context.Queue(), context.Queue()
+    processes = [context.Process(target=_fork_worker, args=(function, tasks, results), daemon=True)
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+    try:
+        for item in items:
+            tasks.put(item)
+        for _ in processes:
+            tasks.put(None)
+        pending = set(items)
+        while pending:
+            try:
+                item, result, error = results.get(timeout=FORK_POLL)
+            except queue.Empty:
+                if not any(process.is_alive() for process in processes):
+                    break
+                continue
+            pending.discard(item)
+            yield item, result, error
+        for item in pending:
+            yield item, None, FORK_WORKER_DIED
+    finally:
+        for process in processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+# --- end of shared capture reader -------------------------------------------------------------
+
+
+def _collect_messages(view):
+    messages = {}
+    pmkids = set()
+    frames = 0
+    decoded = 0
+    eapol = 0
+    for linktype, frame in iter_frames(view):
+        frames += 1
+        frame = dot11_frame(linktype, frame)
+        if frame is None or len(frame) < 24:
+            continue
+        decoded += 1
+        key = eapol_key(frame)
+        if key is None:
+            continue
+        eapol += 1
+        ap, station, key_info, replay, nonce, key_frame = key
+        message = eapol_message(key_info, nonce)
+        if message is None:
+            continue
+        if message == 1:
+            pmkid = eapol_pmkid(key_frame)
+            if pmkid is not None:
+                pmkids.add((ap, station, pmkid))
+        messages.setdefault((ap, station), set()).add((message, replay))
+    return frames, decoded, eapol, messages, pmkids
+
+
+def analyse_capture(filename):
+    # walks the capture once through a read only mmap, frames are never copied out of the mapping
+    with open(filename, 'rb') as capture:
+        if os.fstat(capture.fileno()).st_size == 0:
+            return CaptureVerdict()
+        with mmap.mmap(capture.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                frames, decoded, eapol, messages, pmkids = _collect_messages(view)
+            finally:
+                view.release()
+    handshakes = 0
+    message_pairs = set()
+    for seen in messages.values():
+        pairs = set()
+        for message, replay in seen:
+            if message == 2 and (1, replay) in seen:
+                pairs.add('M1+M2')
+            if message == 2 and (3, replay + 1) in seen:
+                pairs.add('M2+M3')
+            if message == 4 and (3, replay) in seen:
+                pairs.add('M3+M4')
+        if pairs & {'M1+M2', 'M2+M3'}:
+            handshakes += 1
+        message_pairs |= pairs
+    return CaptureVerdict(frames, handshakes, len(pmkids), sorted(message_pairs), decoded, eapol)
+
+
+def _analyse_values(filename):
+    return analyse_capture(filename).to_list()
+
+
+def analyse_many(filenames, workers):
+    # yields (filename, verdict or None), verdicts cross the process boundary as lists
+    for filename, values, error in fork_map(_analyse_values, filenames, workers):
+        if error is not None:
+            logging.error(f"[AircrackOnly] could not check {filename}: {error}")
+        yield filename, CaptureVerdict.from_list(values) if values is not None else None
+
+
+class VerdictCache:
+    # verdicts of captures that were kept, keyed by path and only valid for the same size and mtime.
+    # changes are only written by save() when something changed, captures gone from disk are dropped then.
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._dirty = False
+        try:
+            with open(path, 'r') as cache_file:
+                self._entries = json.load(cache_file)
+            self._dirty = True
+        except (FileNotFoundError, ValueError):
+            self._entries = {}
+
+    def get(self, filename, st):
+        with self._lock:
+            entry = self._entries.get(filename)
+        if entry is None or entry[:2] != [st.st_size, st.st_mtime_ns]:
+            return None
+        return CaptureVerdict.from_list(entry[2])
+
+    def put(self, filename, st, verdict):
+        with self._lock:
+            self._entries[filename] = [st.st_size, st.st_mtime_ns, verdict.to_list()]
+            self._dirty = True
+
+    def discard(self, filename):
+        with self._lock:
+            if self._entries.pop(filename, None) is not None:
+                self._dirty = True
+
+    def items(self):
+        with self._lock:
+            entries = list(self._entries.items())
+        return [(filename, entry[0], entry[1], CaptureVerdict.from_list(entry[2])) for filename, entry in entries]
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            filenames = list(self._entries)
+        missing = [filename for filename in filenames if not os.path.exists(filename)]
+        with self._lock:
+            for filename in missing:
+                self._entries.pop(filename, None)
+            data = json.dumps(self._entries)
+            self._dirty = False
+        with open(f"{self.path}.tmp", 'w') as cache_file:
+            cache_file.write(data)
+        os.replace(f"{self.path}.tmp", self.path)
+
+
+class ValidationQueue:
+    # bounded queue of captures waiting for analysis. repeated events for a file that is still
+    # waiting are coalesced, when the queue stays full for put_timeout seconds the event is dropped.
+    def __init__(self, handler, workers=1, maxsize=64, put_timeout=1.0):
+        self.handler = handler
+        self.put_timeout = put_timeout
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._stats = {'queued': 0, 'coalesced': 0, 'dropped': 0, 'processed': 0,
+                       'latency_total': 0.0, 'latency_max': 0.0, 'last_latency': None}
+        self._threads = [threading.Thread(target=self._run, daemon=True) for _ in range(max(1, workers))]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, filename):
+        with self._lock:
+            if filename in self._pending:
+                self._stats['coalesced'] += 1
+                return True
+            self._pending.add(filename)
+        try:
+            self._queue.put((filename, time.monotonic()), timeout=self.put_timeout)
+        except queue.Full:
+            with self._lock:
+                self._pending.discard(filename)
+                self._stats['dropped'] += 1
+            logging.warning(f"[AircrackOnly] validation queue full, skipping {filename}")
+            return False
+        with self._lock:
+            self._stats['queued'] += 1
+        return True
+
+    def stop(self):
+        for _ in self._threads:
+            self._queue.put(None)
+
+    def metrics(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['depth'] = self._queue.qsize()
+        stats['latency_avg'] = stats['latency_total'] / stats['processed'] if stats['processed'] else None
+        return stats
+
+    def _run(self):
+        for item in iter(self._queue.get, None):
+            filename, queued_at = item
+            with self._lock:
+                self._pending.discard(filename)
+            try:
+                self.handler(filename)
+            except Exception as e:
+                logging.error(f"[AircrackOnly] error validating {filename}: {e}")
+            latency = time.monotonic() - queued_at
+            with self._lock:
+                self._stats['processed'] += 1
+                self._stats['latency_total'] += latency
+                self._stats['latency_max'] = max(self._stats['latency_max'], latency)
+                self._stats['last_latency'] = latency
+
 
 class AircrackOnly(plugins.Plugin):
     __author__ = 'pwnagotchi [at] rossmarks [dot] uk'
@@ -17,36 +448,193 @@ class AircrackOnly(plugins.Plugin):
     __license__ = 'GPL3'
     __description__ = 'confirm pcap contains handshake/PMKID or delete it'
 
+    def __init__(self):
+        self.handshake_dir = '/root/handshakes'
+        self.backfill_status = {}
+        self.backfill_started = False
+        self.retention_status = {'pruned': 0, 'reclaimed': 0}
+        self.stop_event = threading.Event()
+
     def on_loaded(self):
+        self.cache = VerdictCache(self.options.get('cache_path', '/root/.aircrackonly_verdicts.json'))
+        self.validation = ValidationQueue(self.validate,
+                                          workers=self.options.get('workers', 1),
+                                          maxsize=self.options.get('queue_size', 64))
+        threading.Thread(target=self.save_cache, daemon=True).start()
         logging.info("aircrackonly plugin loaded")
-        check = subprocess.run(
-            ('/usr/bin/dpkg -l aircrack-ng | grep aircrack-ng | awk \'{print $2, $3}\''), shell=True, stdout=subprocess.PIPE)
-        check = check.stdout.decode('utf-8').strip()
-        if check != "aircrack-ng <none>":
-            logging.info("aircrackonly: Found " + check)
-        else:
-            logging.warning("aircrack-ng is not installed!")
+
+    def save_cache(self):
+        # verdicts are written on a timer instead of after every handshake
+        while not self.stop_event.wait(CACHE_SAVE_INTERVAL):
+            try:
+                self.cache.save()
+            except OSError as e:
+                logging.error(f"[AircrackOnly] could not save verdict cache: {e}")
+
+    def on_config_changed(self, config):
+        self.handshake_dir = config['bettercap']['handshakes']
+        if self.options.get('backfill', False) and not self.backfill_started:
+            self.backfill_started = True
+            threading.Thread(target=self.backfill, daemon=True).start()
+
+    def on_unload(self, ui):
+        self.validation.stop()
+        self.stop_event.set()
+        self.cache.save()
+
+    def on_webhook(self, path, request):
+        metrics = self.validation.metrics()
+        metrics['backfill'] = self.backfill_status
+        metrics['retention'] = self.retention_status
+        return jsonify(metrics)
 
     def on_handshake(self, agent, filename, access_point, client_station):
-        todelete = 0
-        handshakeFound = 0
-
-        result = subprocess.run(('/usr/bin/aircrack-ng ' + filename + ' | grep "1 handshake" | awk \'{print $2}\''),
-                                shell=True, stdout=subprocess.PIPE)
-        result = result.stdout.decode('utf-8').translate({ord(c): None for c in string.whitespace})
-        if result:
-            handshakeFound = 1
-            logging.info("[AircrackOnly] contains handshake")
-
-        if handshakeFound == 0:
-            result = subprocess.run(('/usr/bin/aircrack-ng ' + filename + ' | grep "PMKID" | awk \'{print $2}\''),
-                                    shell=True, stdout=subprocess.PIPE)
-            result = result.stdout.decode('utf-8').translate({ord(c): None for c in string.whitespace})
-            if result:
-                logging.info("[AircrackOnly] contains PMKID")
-            else:
-                todelete = 1
-
-        if todelete == 1:
-            os.remove(filename)
+        self.validation.submit(filename)
+
+    def validate(self, filename):
+        try:
+            st = os.stat(filename)
+        except FileNotFoundError:
+            return
+        verdict = self.cache.get(filename, st)
+        if verdict is None:
+            try:
+                verdict = analyse_capture(filename)
+            except (OSError, ValueError, struct.error) as e:
+                logging.error(f"[AircrackOnly] could not read {filename}: {e}")
+                return
+        if not self.judge(filename, st, verdict):
+            match = CAPTURE_BSSID.search(filename)
+            if match:
+                self.retain({match.group(1).lower()})
+
+    def judge(self, filename, st, verdict):
+        # keeps or removes the capture, returns True when it was removed
+        logging.debug(f"[AircrackOnly] {filename}: {verdict}")
+        if verdict.handshakes:
+            logging.info(f"[AircrackOnly] contains handshake {', '.join(verdict.message_pairs)}")
+        elif verdict.pmkids:
+            logging.info("[AircrackOnly] contains PMKID")
+        elif not verdict.decoded:
+            # an empty, truncated or unsupported link type capture says nothing about crackability
+            logging.warning(f"[AircrackOnly] no 802.11 frames decoded from {filename}, keeping it")
+        else:
+            self.cache.discard(filename)
+            try:
+                os.remove(filename)
+            except FileNotFoundError:
+                return False
             logging.warning("Removed uncrackable pcap " + filename)
+            return True
+        self.cache.put(filename, st, verdict)
+        return False
+
+    def backfill(self):
+        started = time.monotonic()
+        pending = {}
+        try:
+            with os.scandir(self.handshake_dir) as entries:
+                for entry in entries:
+                    if entry.name.endswith('.pcap') and entry.is_file():
+                        st = entry.stat()
+                        if self.cache.get(entry.path, st) is None:
+                            pending[entry.path] = st
+        except OSError as e:
+            logging.error(f"[AircrackOnly] backfill could not scan {self.handshake_dir}: {e}")
+            return
+        status = self.backfill_status
+        status.update({'total': len(pending), 'done': 0, 'bytes': 0, 'removed': 0, 'reclaimed': 0,
+                       'files_per_second': 0.0, 'bytes_per_second': 0.0, 'running': True})
+        logging.info(f"[AircrackOnly] backfill: {len(pending)} captures to check")
+        last_report = started
+        for filename, verdict in analyse_many(list(pending), self.options.get('backfill_workers', os.cpu_count() or 1)):
+            st = pending[filename]
+            status['done'] += 1
+            status['bytes'] += st.st_size
+            if verdict is not None:
+                try:
+                    current = os.stat(filename)
+                except FileNotFoundError:
+                    continue
+                # a capture bettercap appended to meanwhile is left to the live queue
+                if (current.st_size, current.st_mtime_ns) == (st.st_size, st.st_mtime_ns):
+                    if self.judge(filename, st, verdict):
+                        status['removed'] += 1
+                        status['reclaimed'] += st.st_size
+            elapsed = max(time.monotonic() - started, 1e-6)
+            status['files_per_second'] = status['done'] / elapsed
+            status['bytes_per_second'] = status['bytes'] / elapsed
+            if time.monotonic() - last_report >= 10:
+                last_report = time.monotonic()
+                self.cache.save()
+                logging.info(f"[AircrackOnly] backfill {status['done']}/{status['total']}, "
+                             f"{status['files_per_second']:.1f} files/s, {status['reclaimed']} bytes reclaimed")
+        status['running'] = False
+        self.retain()
+        self.cache.save()
+        logging.info(f"[AircrackOnly] backfill done: {status['done']} checked, {status['removed']} removed, "
+                     f"{status['reclaimed']} bytes reclaimed in {time.monotonic() - started:.1f}s")
+
+    @staticmethod
+    def _capture_files(directory):
+        # capture stem to the other files sharing it, skipping the pcaps themselves
+        files = {}
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.name.endswith('.pcap') or not entry.is_file():
+                        continue
+                    # ssids may contain dots, the stem is whatever ends in the _bssid part
+                    for match in CAPTURE_STEM.finditer(entry.name):
+                        files.setdefault(entry.name[:match.end()], []).append(entry.path)
+        except OSError as e:
+            logging.error(f"[AircrackOnly] could not scan {directory}: {e}")
+        return files
+
+    def retain(self, bssids=None):
+        # prunes all but the best keep_per_bssid captures of the given bssids (all when None)
+        keep = self.options.get('keep_per_bssid', 0)
+        if not keep:
+            return
+        groups = {}
+        for filename, size, mtime_ns, verdict in self.cache.items():
+            match = CAPTURE_BSSID.search(filename)
+            if match is None or not verdict.crackable:
+                continue
+            bssid = match.group(1).lower()
+            if bssids is None or bssid in bssids:
+                groups.setdefault(bssid, []).append((verdict.score() + (mtime_ns,), filename, size, mtime_ns))
+        pruned = 0
+        reclaimed = 0
+        siblings = None
+        for bssid, captures in groups.items():
+            if len(captures) <= keep:
+                continue
+            captures.sort(reverse=True)
+            for _, filename, size, mtime_ns in captures[keep:]:
+                self.cache.discard(filename)
+                try:
+                    st = os.stat(filename)
+                    # leave captures that changed since they were judged for the next validation
+                    if (st.st_size, st.st_mtime_ns) != (size, mtime_ns):
+                        continue
+                    os.remove(filename)
+                except FileNotFoundError:
+                    continue
+                pruned += 1
+                reclaimed += size
+                # the .22000/.16800/.2500/.gps.json files next to it belong to the same capture
+                if siblings is None:
+                    siblings = self._capture_files(os.path.dirname(filename))
+                for sibling in siblings.get(os.path.basename(filename)[:-len('.pcap')], ()):
+                    try:
+                        sibling_size = os.stat(sibling).st_size
+                        os.remove(sibling)
+                    except FileNotFoundError:
+                        continue
+                    reclaimed += sibling_size
+                logging.info(f"[AircrackOnly] pruned {filename}, a better capture of {bssid} is kept")
+        if pruned:
+            self.retention_status['pruned'] += pruned
+            self.retention_status['reclaimed'] += reclaimed
+            logging.info(f"[AircrackOnly] retention pruned {pruned} captures, {reclaimed} bytes saved")
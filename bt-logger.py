@@ -1,17 +1,841 @@
 # gps requires gpsdeasy to be installed
 #main.plugins.bt-logger.enabled = true
 #main.plugins.bt-logger.gps = true
+# gps_track records a track to place sightings along, it only runs with gps enabled
 #main.plugins.bt-logger.gps_track = true
+#main.plugins.bt-logger.track_dir = "/root/bt-track"
+#main.plugins.bt-logger.track_interval = 5
+#main.plugins.bt-logger.track_min_distance = 10
+#main.plugins.bt-logger.track_max_gap = 60
+#main.plugins.bt-logger.track_segment = 3600
+# finished segments kept as gpx (0 keeps all), their jsonl is removed once the gpx is written
+#main.plugins.bt-logger.track_keep = 168
+#main.plugins.bt-logger.track_keep_jsonl = false
 #main.plugins.bt-logger.id_only = true
 #main.plugins.bt-logger.display = true
+#main.plugins.bt-logger.compact_interval = 3600
+#main.plugins.bt-logger.queue_size = 256
+#main.plugins.bt-logger.batch_size = 32
+#main.plugins.bt-logger.db_path = "/root/.btlogger.db"
+# vendor lookup reads the ieee table from the ieee-data package and compiles it once into oui_index
+#main.plugins.bt-logger.oui_path = "/usr/share/ieee-data/oui.txt"
+#main.plugins.bt-logger.oui_index = "/root/.btlogger.oui"
 
-import pwnagotchi, logging, re, subprocess, io, socket, json, time
+import pwnagotchi, logging, os, queue, re, sqlite3, subprocess, io, socket, json, time, math, threading, bisect, mmap, struct
 import pwnagotchi.plugins as plugins
 import pwnagotchi.ui.fonts as fonts
-from flask import Flask, render_template_string
+from flask import Flask, render_template_string, jsonify
 from pwnagotchi.ui.components import LabeledValue
 from pwnagotchi.ui.view import BLACK
 
+DEDUP_TOLERANCE = 0.005
+SCAN_QUEUE_SIZE = 256
+SCAN_BATCH_SIZE = 32
+SCAN_BATCH_WAIT = 1.0
+API_MAX_LIMIT = 500
+CLUSTER_MIN_ZOOM = 0
+CLUSTER_MAX_ZOOM = 18
+CLUSTER_GRID_MAX_ZOOM = 12
+CLUSTER_CELL_PX = 64
+OUI_LINE = re.compile(r'^([0-9A-F]{2})-([0-9A-F]{2})-([0-9A-F]{2})\s+\(hex\)\s+(.+?)\s*$')
+OUI_MAGIC = b'OUI1'
+OUI_HEADER = struct.Struct('<4sI')
+GPSD_ADDRESS = ('localhost', 2947)
+EARTH_RADIUS = 6371000.0
+TRACK_FLUSH_POINTS = 30
+TRACK_FLUSH_SECONDS = 60
+TRACK_MEMORY = 3600
+LOG_LINE = re.compile(r'^(.*?) ?([0-9A-F]{2}(?::[0-9A-F]{2}){5})(?:: (-?\d+(?:\.\d+)?), (-?\d+(?:\.\d+)?))?$')
+SORT_COLUMNS = {
+    'name': 'name COLLATE NOCASE',
+    'mac': 'mac',
+    'first_seen': 'first_seen',
+    'last_seen': 'last_seen',
+    'count': 'count',
+    'vendor': 'vendor COLLATE NOCASE',
+}
+STORE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS devices (
+    mac TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    first_seen REAL NOT NULL,
+    last_seen REAL NOT NULL,
+    count INTEGER NOT NULL DEFAULT 1,
+    latitude REAL,
+    longitude REAL,
+    vendor TEXT
+);
+CREATE INDEX IF NOT EXISTS devices_name ON devices (name COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS devices_last_seen ON devices (last_seen);
+CREATE INDEX IF NOT EXISTS devices_position ON devices (latitude, longitude);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+'''
+TEMPLATE = '''
+<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta http-equiv="X-UA-Compatible" content="IE=edge">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Bluetooth Devices</title>
+    <link rel="stylesheet" href="https://unpkg.com/leaflet@1.9.4/dist/leaflet.css">
+    <script src="https://unpkg.com/leaflet@1.9.4/dist/leaflet.js"></script>
+    <style>
+        #map {
+            height: 400px;
+            margin-bottom: 8px;
+        }
+        table {
+            width: 100%;
+            border-collapse: collapse;
+        }
+        th, td {
+            border: 1px solid black;
+            padding: 8px;
+            text-align: left;
+        }
+        th {
+            background-color: #f2f2f2;
+            cursor: pointer;
+        }
+        form input {
+            margin: 0 8px 8px 0;
+        }
+    </style>
+</head>
+<body>
+    <h1>Bluetooth Devices</h1>
+    <div id="map"></div>
+    <form id="filters">
+        <input name="mac" placeholder="MAC prefix">
+        <input name="name" placeholder="Name">
+        <input name="vendor" placeholder="Vendor">
+        <input name="since" type="datetime-local" title="Last seen after">
+        <input name="until" type="datetime-local" title="First seen before">
+        <input name="bbox" placeholder="min_lon,min_lat,max_lon,max_lat">
+        <button type="submit">Filter</button>
+    </form>
+    <p><button id="prev">&lt;</button> <span id="summary"></span> <button id="next">&gt;</button></p>
+    <table>
+        <thead>
+            <tr>
+                <th data-sort="name">Name</th>
+                <th data-sort="mac">MAC Address</th>
+                <th data-sort="vendor">Vendor</th>
+                <th data-sort="first_seen">First Seen</th>
+                <th data-sort="last_seen">Last Seen</th>
+                <th data-sort="count">Seen</th>
+                <th>Google Maps</th>
+            </tr>
+        </thead>
+        <tbody id="devices"></tbody>
+    </table>
+    <script>
+        // rows are paged and filtered by the unit, the page only ever holds one page of them
+        var state = { offset: 0, limit: 100, sort: "last_seen", dir: "desc", total: 0, filters: {} };
+        var tbody = document.getElementById("devices");
+        function cell(row, text) {
+            var td = row.insertCell();
+            td.textContent = text;
+            return td;
+        }
+        function when(seconds) {
+            return new Date(seconds * 1000).toLocaleString();
+        }
+        function load() {
+            var params = new URLSearchParams(Object.assign({
+                offset: state.offset, limit: state.limit, sort: state.sort, dir: state.dir
+            }, state.filters));
+            fetch('/plugins/bt-logger/api/devices?' + params.toString())
+                .then(response => response.json())
+                .then(data => {
+                    state.total = data.total || 0;
+                    tbody.innerHTML = "";
+                    (data.rows || []).forEach(device => {
+                        var row = tbody.insertRow();
+                        cell(row, device.name);
+                        cell(row, device.mac);
+                        cell(row, device.vendor || "");
+                        cell(row, when(device.first_seen));
+                        cell(row, when(device.last_seen));
+                        cell(row, device.count);
+                        var maps = row.insertCell();
+                        if (device.latitude !== null && device.longitude !== null) {
+                            var link = document.createElement("a");
+                            link.href = "https://www.google.com/maps/search/?api=1&query=" + device.latitude + "," + device.longitude;
+                            link.textContent = device.latitude + " " + device.longitude;
+                            maps.appendChild(link);
+                        }
+                    });
+                    var end = Math.min(state.offset + state.limit, state.total);
+                    document.getElementById("summary").textContent =
+                        (state.total ? state.offset + 1 : 0) + "-" + end + " of " + state.total;
+                })
+                .catch(error => console.error('Error:', error));
+        }
+        document.getElementById("filters").onsubmit = function(event) {
+            event.preventDefault();
+            state.filters = {};
+            new FormData(this).forEach((value, key) => {
+                if (!value) {
+                    return;
+                }
+                if (key === "since" || key === "until") {
+                    value = new Date(value).getTime() / 1000;
+                }
+                state.filters[key] = value;
+            });
+            state.offset = 0;
+            load();
+        };
+        document.getElementById("prev").onclick = function() {
+            state.offset = Math.max(state.offset - state.limit, 0);
+            load();
+        };
+        document.getElementById("next").onclick = function() {
+            if (state.offset + state.limit < state.total) {
+                state.offset += state.limit;
+                load();
+            }
+        };
+        document.querySelectorAll("th[data-sort]").forEach(th => {
+            th.onclick = function() {
+                var sort = th.getAttribute("data-sort");
+                state.dir = state.sort === sort && state.dir === "asc" ? "desc" : "asc";
+                state.sort = sort;
+                state.offset = 0;
+                load();
+            };
+        });
+        load();
+        // the map only asks for the clusters of the visible area at the current zoom
+        if (window.L) {
+            var map = L.map("map").setView([0, 0], 2);
+            var markers = L.layerGroup().addTo(map);
+            L.tileLayer("https://tile.openstreetmap.org/{z}/{x}/{y}.png", {
+                maxZoom: 19,
+                attribution: "&copy; OpenStreetMap contributors"
+            }).addTo(map);
+            function loadClusters() {
+                var bounds = map.getBounds();
+                var params = new URLSearchParams({
+                    zoom: map.getZoom(),
+                    bbox: [bounds.getWest(), bounds.getSouth(), bounds.getEast(), bounds.getNorth()].join(",")
+                });
+                fetch('/plugins/bt-logger/api/clusters?' + params.toString())
+                    .then(response => response.json())
+                    .then(data => {
+                        markers.clearLayers();
+                        (data.clusters || []).forEach(cluster => {
+                            L.circleMarker([cluster.lat, cluster.lon], {
+                                radius: Math.min(6 + Math.log2(cluster.count) * 3, 30)
+                            }).bindTooltip(String(cluster.count)).on("click", function() {
+                                map.setView([cluster.lat, cluster.lon], Math.min(map.getZoom() + 2, 18));
+                            }).addTo(markers);
+                        });
+                    })
+                    .catch(error => console.error('Error:', error));
+            }
+            map.on("moveend", loadClusters);
+            loadClusters();
+        } else {
+            document.getElementById("map").style.display = "none";
+        }
+    </script>
+</body>
+</html>
+'''
+HEX_NAME = re.compile(r'^[0-9A-F]{2}-[0-9A-F]{2}-[0-9A-F]{2}-[0-9A-F]{2}-[0-9A-F]{2}-[0-9A-F]{2}$')
+
+
+def log_sort_key(line):
+    # named devices first, then the ones bluetoothctl could only name by address
+    words = line.split()
+    return bool(words) and bool(HEX_NAME.search(words[0])), line
+
+
+class SightingIndex:
+    # in-memory view of the interim log for duplicate checks. sightings are bucketed per device
+    # on a grid of DEDUP_TOLERANCE degrees, so a check only looks at the neighbouring cells.
+    # the interim file is loaded once and then only appended to.
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._cells = {}
+        try:
+            with open(path, 'r') as interim:
+                for line in interim:
+                    try:
+                        entry, latitude, longitude = line.rstrip('\n').rsplit(' ', 2)
+                        self._index(entry, float(latitude), float(longitude))
+                    except ValueError:
+                        continue
+        except FileNotFoundError:
+            with open(path, 'w'):
+                pass
+
+    @staticmethod
+    def _cell(latitude, longitude):
+        return math.floor(latitude / DEDUP_TOLERANCE), math.floor(longitude / DEDUP_TOLERANCE)
+
+    def _index(self, entry, latitude, longitude):
+        lat_cell, lon_cell = self._cell(latitude, longitude)
+        self._cells.setdefault((entry, lat_cell, lon_cell), []).append((latitude, longitude))
+
+    def is_duplicate(self, entry, latitude, longitude):
+        if latitude is None and longitude is None:
+            latitude, longitude, tolerance = 0.0, 0.0, 0.0
+        else:
+            tolerance = DEDUP_TOLERANCE
+        lat_cell, lon_cell = self._cell(latitude, longitude)
+        with self._lock:
+            for dlat in (-1, 0, 1):
+                for dlon in (-1, 0, 1):
+                    for logged_latitude, logged_longitude in self._cells.get((entry, lat_cell + dlat, lon_cell + dlon), ()):
+                        if tolerance == 0.0:
+                            if logged_latitude == 0 and logged_longitude == 0:
+                                return True
+                        elif abs(logged_latitude - latitude) < tolerance and abs(logged_longitude - longitude) < tolerance:
+                            return True
+        return False
+
+    def add(self, entry, latitude, longitude):
+        self.add_many([(entry, latitude, longitude)])
+
+    def add_many(self, sightings):
+        with self._lock:
+            # no fix is logged as 0, 0 like the gps lookup reports it, so is_duplicate can match it again
+            sightings = [(entry, 0, 0) if latitude is None or longitude is None else (entry, latitude, longitude)
+                         for entry, latitude, longitude in sightings]
+            with open(self.path, 'a') as interim:
+                interim.writelines(f"{entry} {latitude} {longitude}\n" for entry, latitude, longitude in sightings)
+            for entry, latitude, longitude in sightings:
+                try:
+                    self._index(entry, float(latitude), float(longitude))
+                except (TypeError, ValueError):
+                    pass
+
+
+def distance(a, b):
+    # equirectangular, plenty at the few tens of metres the track is thinned by
+    lat_a, lon_a = math.radians(a[0]), math.radians(a[1])
+    lat_b, lon_b = math.radians(b[0]), math.radians(b[1])
+    x = (lon_b - lon_a) * math.cos((lat_a + lat_b) / 2)
+    return math.hypot(x, lat_b - lat_a) * EARTH_RADIUS
+
+
+class TrackRecorder:
+    # keeps one gpsd connection open and samples the fix every interval seconds. a sample is kept
+    # when it moved min_distance metres or max_gap seconds passed, kept points are buffered and
+    # appended to a jsonl segment that is rolled every segment seconds and written out as gpx,
+    # only the newest keep segments are kept. recent points stay in memory so sightings can be
+    # placed along the track.
+    def __init__(self, directory, interval=5, min_distance=10, max_gap=60, segment=3600, keep=168, keep_jsonl=False):
+        self.directory = directory
+        self.interval = interval
+        self.min_distance = min_distance
+        self.max_gap = max_gap
+        self.segment = segment
+        self.keep = keep
+        self.keep_jsonl = keep_jsonl
+        self.stop_event = threading.Event()
+        self._lock = threading.Lock()
+        self._times = []
+        self._points = []
+        self._latest = None
+        self._sampled = 0
+        self._buffer = []
+        self._write_lock = threading.Lock()
+        self._flushed = time.time()
+        self._segment_path = None
+        self._segment_start = 0
+        self._socket = None
+        os.makedirs(directory, exist_ok=True)
+        try:
+            # segments a previous run did not get to close, e.g. after a crash
+            for name in sorted(os.listdir(directory)):
+                if not name.startswith('track-') or not name.endswith('.jsonl'):
+                    continue
+                segment_path = os.path.join(directory, name)
+                if not keep_jsonl or not os.path.exists(segment_path[:-len('.jsonl')] + '.gpx'):
+                    self.close_segment(segment_path)
+            self.prune()
+        except Exception as e:
+            logging.error(f"[BT-Log] Error cleaning up gps track: {e}")
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                with socket.create_connection(GPSD_ADDRESS, timeout=max(self.interval, 5)) as gpsd_socket:
+                    self._socket = gpsd_socket
+                    gpsd_socket.sendall(b'?WATCH={"enable":true,"json":true}\n')
+                    reports = gpsd_socket.makefile('r', encoding='utf-8', errors='replace')
+                    for line in reports:
+                        if self.stop_event.is_set():
+                            break
+                        try:
+                            report = json.loads(line)
+                        except json.JSONDecodeError:
+                            continue
+                        if report.get('class') == 'TPV' and report.get('mode', 0) >= 2 and 'lat' in report and 'lon' in report:
+                            self.sample(time.time(), report['lat'], report['lon'])
+            except (OSError, ValueError) as e:
+                logging.debug(f"[BT-Log] gpsd track connection: {e}")
+            finally:
+                self._socket = None
+            self.stop_event.wait(self.interval)
+
+    def sample(self, now, latitude, longitude):
+        point = (now, latitude, longitude)
+        with self._lock:
+            # gpsd reports about once a second, the latest fix is kept but only sampled every interval
+            self._latest = point
+            if now - self._sampled < self.interval:
+                return
+            self._sampled = now
+            if self._points:
+                last = self._points[-1]
+                if now - last[0] < self.max_gap and distance(last[1:], point[1:]) < self.min_distance:
+                    return
+            self._times.append(now)
+            self._points.append(point)
+            # only the last TRACK_MEMORY seconds are kept around for placing sightings
+            drop = bisect.bisect_left(self._times, now - TRACK_MEMORY)
+            if drop:
+                del self._times[:drop]
+                del self._points[:drop]
+            self._buffer.append(point)
+        if not self.stop_event.is_set() and (len(self._buffer) >= TRACK_FLUSH_POINTS or now - self._flushed >= TRACK_FLUSH_SECONDS):
+            self.flush()
+
+    def position_at(self, when):
+        with self._lock:
+            points = self._points
+            latest = self._latest
+            i = bisect.bisect_left(self._times, when)
+            if i < len(points) and points[i][0] == when:
+                return points[i][1], points[i][2]
+            before = points[i - 1] if i > 0 else None
+            after = points[i] if i < len(points) else None
+        if after is None and latest is not None and (before is None or latest[0] > before[0]) and latest[0] >= when:
+            after = latest
+        if before is not None and after is not None:
+            ratio = (when - before[0]) / (after[0] - before[0])
+            return before[1] + (after[1] - before[1]) * ratio, before[2] + (after[2] - before[2]) * ratio
+        # outside the track the nearest fix stands in, as long as it is recent enough to mean anything
+        nearest = latest if after is None else after
+        if nearest is not None and abs(nearest[0] - when) <= self.max_gap:
+            return nearest[1], nearest[2]
+        return None, None
+
+    def flush(self, close=False):
+        with self._write_lock:
+            with self._lock:
+                points, self._buffer = self._buffer, []
+            self._flushed = time.time()
+            try:
+                lines = []
+                for point in points:
+                    if self._segment_path is None or point[0] - self._segment_start >= self.segment:
+                        self.write_segment(lines)
+                        lines = []
+                        self.roll(point[0])
+                    lines.append(json.dumps({"time": point[0], "lat": point[1], "lon": point[2]}) + '\n')
+                self.write_segment(lines)
+                if close and self._segment_path is not None:
+                    self.close_segment(self._segment_path)
+            except Exception as e:
+                logging.error(f"[BT-Log] Error writing gps track: {e}")
+
+    def write_segment(self, lines):
+        if lines:
+            with open(self._segment_path, 'a') as segment:
+                segment.writelines(lines)
+
+    def roll(self, start):
+        if self._segment_path is not None:
+            self.close_segment(self._segment_path)
+        self._segment_start = start
+        self._segment_path = os.path.join(self.directory, time.strftime('track-%Y%m%d-%H%M%S.jsonl', time.gmtime(start)))
+        self.prune()
+
+    def close_segment(self, segment_path):
+        self.write_gpx(segment_path)
+        if not self.keep_jsonl and os.path.exists(segment_path):
+            os.remove(segment_path)
+
+    def prune(self):
+        # segment names sort by their start time, the one being recorded does not count
+        if not self.keep:
+            return
+        current = os.path.basename(self._segment_path)[:-len('.jsonl')] if self._segment_path else None
+        segments = sorted({name.rsplit('.', 1)[0] for name in os.listdir(self.directory)
+                           if name.startswith('track-') and name.endswith(('.gpx', '.jsonl'))} - {current})
+        for stem in segments[:max(len(segments) - self.keep, 0)]:
+            for extension in ('.gpx', '.jsonl'):
+                try:
+                    os.remove(os.path.join(self.directory, stem + extension))
+                except FileNotFoundError:
+                    pass
+
+    @staticmethod
+    def write_gpx(segment_path):
+        if not os.path.exists(segment_path):
+            return
+        gpx_path = segment_path[:-len('.jsonl')] + '.gpx'
+        tmp_path = f"{gpx_path}.tmp"
+        with open(segment_path, 'r') as segment, open(tmp_path, 'w') as gpx:
+            gpx.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                      '<gpx version="1.1" creator="bt-logger" xmlns="http://www.topografix.com/GPX/1/1">\n'
+                      '<trk><trkseg>\n')
+            for line in segment:
+                try:
+                    point = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                stamp = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(point['time']))
+                gpx.write(f'<trkpt lat="{point["lat"]}" lon="{point["lon"]}"><time>{stamp}</time></trkpt>\n')
+            gpx.write('</trkseg></trk>\n</gpx>\n')
+        os.replace(tmp_path, gpx_path)
+
+    def stop(self):
+        # shutting the socket down wakes a blocked gpsd read, the thread is done before the last flush
+        self.stop_event.set()
+        gpsd_socket = self._socket
+        if gpsd_socket is not None:
+            try:
+                gpsd_socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self._thread.join(timeout=max(self.interval, 5) + 1)
+        if self._thread.is_alive():
+            logging.warning('[BT-Log] gps track thread did not stop, the last segment may be incomplete')
+        self.flush(close=True)
+
+
+class OuiPrefixes:
+    # sequence view over the packed 3 byte prefixes so bisect can search the mmap in place
+    def __init__(self, buffer, start, count):
+        self._buffer = buffer
+        self._start = start
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i):
+        at = self._start + i * 3
+        return self._buffer[at:at + 3]
+
+
+class OuiTable:
+    # ieee oui assignments compiled into a sorted, memory mapped index:
+    # header, count 3 byte prefixes, count + 1 little endian name offsets, then the utf-8 names.
+    # the text table is only parsed when the index is missing or older than it.
+    def __init__(self, source, index):
+        self.source = source
+        self.index = index
+        self._file = None
+        self._map = None
+        self._prefixes = None
+        self._offsets = 0
+        self._names = 0
+        try:
+            if not os.path.exists(index) or (os.path.exists(source) and os.path.getmtime(source) > os.path.getmtime(index)):
+                self.compile(source, index)
+            self._open(index)
+        except FileNotFoundError:
+            logging.warning(f"[BT-Log] No OUI table at {source}, vendors will not be looked up")
+        except Exception as e:
+            logging.error(f"[BT-Log] Error loading OUI table: {e}")
+            self.close()
+
+    @staticmethod
+    def compile(source, index):
+        vendors = {}
+        with open(source, 'r', encoding='utf-8', errors='replace') as table:
+            for line in table:
+                match = OUI_LINE.match(line)
+                if match:
+                    vendors.setdefault(bytes.fromhex(''.join(match.group(1, 2, 3))), match.group(4))
+        prefixes = sorted(vendors)
+        names = bytearray()
+        offsets = []
+        for prefix in prefixes:
+            offsets.append(len(names))
+            names += vendors[prefix].encode('utf-8')
+        offsets.append(len(names))
+        tmp_index = f"{index}.tmp"
+        with open(tmp_index, 'wb') as f:
+            f.write(OUI_HEADER.pack(OUI_MAGIC, len(prefixes)))
+            f.write(b''.join(prefixes))
+            f.write(struct.pack(f'<{len(offsets)}I', *offsets))
+            f.write(names)
+        os.replace(tmp_index, index)
+        logging.info(f"[BT-Log] Compiled {len(prefixes)} OUI assignments into {index}")
+
+    def _open(self, index):
+        self._file = open(index, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count = OUI_HEADER.unpack_from(self._map, 0)
+        if magic != OUI_MAGIC:
+            raise ValueError(f"{index} is not an OUI index")
+        self._prefixes = OuiPrefixes(self._map, OUI_HEADER.size, count)
+        self._offsets = OUI_HEADER.size + count * 3
+        self._names = self._offsets + (count + 1) * 4
+
+    def lookup(self, mac):
+        if self._prefixes is None:
+            return None
+        try:
+            prefix = bytes.fromhex(mac.replace(':', '').replace('-', '')[:6])
+        except ValueError:
+            return None
+        # locally administered (random / private) addresses are not assigned to anyone
+        if len(prefix) != 3 or prefix[0] & 0x02:
+            return None
+        i = bisect.bisect_left(self._prefixes, prefix)
+        if i == len(self._prefixes) or self._prefixes[i] != prefix:
+            return None
+        start, end = struct.unpack_from('<II', self._map, self._offsets + i * 4)
+        return self._map[self._names + start:self._names + end].decode('utf-8', errors='replace')
+
+    def close(self):
+        self._prefixes = None
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class DeviceClusters:
+    # per zoom level grid of CLUSTER_CELL_PX map pixels, each cell holds how many devices were last
+    # seen in it and the sum of their positions. a device moving only touches its old and new cells.
+    # only the coarse zooms up to CLUSTER_GRID_MAX_ZOOM are kept, deeper ones cover so little ground
+    # that the store aggregates them on request from the positions in the visible bbox.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._positions = {}
+        self._zooms = [{} for _ in range(CLUSTER_MIN_ZOOM, CLUSTER_GRID_MAX_ZOOM + 1)]
+
+    @staticmethod
+    def _pixel(latitude, longitude, zoom):
+        # web mercator pixels, the same grid slippy map tiles are cut from
+        scale = 256 * (1 << zoom)
+        latitude = min(max(latitude, -85.05112878), 85.05112878)
+        sin_lat = math.sin(math.radians(latitude))
+        x = (longitude + 180.0) / 360.0 * scale
+        y = (0.5 - math.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)) * scale
+        return x, y
+
+    @classmethod
+    def cell(cls, latitude, longitude, zoom):
+        x, y = cls._pixel(latitude, longitude, zoom)
+        return int(x // CLUSTER_CELL_PX), int(y // CLUSTER_CELL_PX)
+
+    @classmethod
+    def aggregate(cls, positions, zoom):
+        cells = {}
+        for latitude, longitude in positions:
+            key = cls.cell(latitude, longitude, zoom)
+            cell = cells.get(key)
+            if cell is None:
+                cell = cells[key] = [0, 0.0, 0.0]
+            cell[0] += 1
+            cell[1] += latitude
+            cell[2] += longitude
+        return [{"lat": sum_lat / count, "lon": sum_lon / count, "count": count}
+                for count, sum_lat, sum_lon in cells.values()]
+
+    def _add(self, latitude, longitude, sign):
+        for zoom in range(CLUSTER_MIN_ZOOM, CLUSTER_GRID_MAX_ZOOM + 1):
+            cells = self._zooms[zoom - CLUSTER_MIN_ZOOM]
+            key = self.cell(latitude, longitude, zoom)
+            cell = cells.get(key)
+            if cell is None:
+                cell = cells[key] = [0, 0.0, 0.0]
+            cell[0] += sign
+            cell[1] += sign * latitude
+            cell[2] += sign * longitude
+            if cell[0] <= 0:
+                del cells[key]
+
+    def move(self, mac, latitude, longitude):
+        with self._lock:
+            old = self._positions.get(mac)
+            if old == (latitude, longitude):
+                return
+            if old is not None:
+                self._add(old[0], old[1], -1)
+            self._positions[mac] = (latitude, longitude)
+            self._add(latitude, longitude, 1)
+
+    def clusters(self, zoom, bbox=None):
+        zoom = min(max(int(zoom), CLUSTER_MIN_ZOOM), CLUSTER_GRID_MAX_ZOOM)
+        bounds = None
+        if bbox is not None:
+            min_lon, min_lat, max_lon, max_lat = bbox
+            bounds = self.cell(max_lat, min_lon, zoom) + self.cell(min_lat, max_lon, zoom)
+        with self._lock:
+            cells = list(self._zooms[zoom - CLUSTER_MIN_ZOOM].items())
+        clusters = []
+        for (cx, cy), (count, sum_lat, sum_lon) in cells:
+            if bounds is not None and not (bounds[0] <= cx <= bounds[2] and bounds[1] <= cy <= bounds[3]):
+                continue
+            clusters.append({"lat": sum_lat / count, "lon": sum_lon / count, "count": count})
+        return zoom, clusters
+
+
+class SightingStore:
+    # one row per mac with first/last seen, how often it was seen and where it was last seen.
+    # wal keeps the webhook reading while the scanner writes, the first open imports bluetooth.log.
+    def __init__(self, path, log_path=None, vendors=None):
+        self.path = path
+        self.vendors = vendors
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(STORE_SCHEMA)
+        self._upgrade()
+        if log_path and self._meta('migrated') is None:
+            self.migrate(log_path)
+        self.clusters = DeviceClusters()
+        for row in self._db.execute('SELECT mac, latitude, longitude FROM devices WHERE latitude IS NOT NULL'):
+            self.clusters.move(row['mac'], row['latitude'], row['longitude'])
+
+    def _upgrade(self):
+        columns = [row['name'] for row in self._db.execute('PRAGMA table_info(devices)')]
+        if 'vendor' not in columns:
+            with self._db:
+                self._db.execute('ALTER TABLE devices ADD COLUMN vendor TEXT')
+                if self.vendors is not None:
+                    macs = [row['mac'] for row in self._db.execute('SELECT mac FROM devices')]
+                    self._db.executemany('UPDATE devices SET vendor = ? WHERE mac = ?',
+                                         [(self.vendors.lookup(mac), mac) for mac in macs])
+        self._db.execute('CREATE INDEX IF NOT EXISTS devices_vendor ON devices (vendor COLLATE NOCASE)')
+
+    def _vendor(self, mac):
+        return self.vendors.lookup(mac) if self.vendors is not None else None
+
+    def _meta(self, key):
+        row = self._db.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row['value'] if row else None
+
+    @staticmethod
+    def _position(latitude, longitude):
+        # 0, 0 is what the gps lookup hands back without a fix
+        try:
+            latitude, longitude = float(latitude), float(longitude)
+        except (TypeError, ValueError):
+            return None, None
+        if latitude == 0 and longitude == 0:
+            return None, None
+        return latitude, longitude
+
+    def _upsert(self, sightings):
+        self._db.executemany('''
+            INSERT INTO devices (mac, name, first_seen, last_seen, count, latitude, longitude, vendor)
+            VALUES (?, ?, ?, ?, 1, ?, ?, ?)
+            ON CONFLICT (mac) DO UPDATE SET
+                name = excluded.name,
+                first_seen = min(first_seen, excluded.first_seen),
+                last_seen = max(last_seen, excluded.last_seen),
+                count = count + 1,
+                latitude = coalesce(excluded.latitude, latitude),
+                longitude = coalesce(excluded.longitude, longitude),
+                vendor = coalesce(excluded.vendor, vendor)
+        ''', [(mac, name, seen, seen) + self._position(latitude, longitude) + (self._vendor(mac),)
+              for name, mac, seen, latitude, longitude in sightings])
+
+    def migrate(self, log_path):
+        # the text log has no timestamps, its mtime is the best guess we have for every line
+        sightings = []
+        try:
+            seen = os.path.getmtime(log_path)
+            with open(log_path, 'r') as log_file:
+                for line in log_file:
+                    match = LOG_LINE.match(line.rstrip('\n'))
+                    if match:
+                        name, mac, latitude, longitude = match.groups()
+                        sightings.append((name or mac, mac, seen, latitude, longitude))
+        except FileNotFoundError:
+            pass
+        with self._lock, self._db:
+            self._upsert(sightings)
+            self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated', ?)", (str(time.time()),))
+        logging.info(f"[BT-Log] Imported {len(sightings)} lines from {log_path} into {self.path}")
+
+    def record_many(self, sightings):
+        with self._lock, self._db:
+            self._upsert(sightings)
+        for name, mac, seen, latitude, longitude in sightings:
+            latitude, longitude = self._position(latitude, longitude)
+            if latitude is not None:
+                self.clusters.move(mac, latitude, longitude)
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT count(*) FROM devices').fetchone()[0]
+
+    def query(self, mac=None, name=None, vendor=None, since=None, until=None, bbox=None,
+              sort='last_seen', direction='desc', offset=0, limit=100):
+        where, args = [], []
+        if mac:
+            # prefix match as a range so it stays on the primary key
+            mac = mac.upper()
+            where.append('mac >= ? AND mac < ?')
+            args += [mac, mac + '\uffff']
+        if name:
+            where.append("name LIKE ? ESCAPE '\\'")
+            args.append('%' + re.sub(r'([%_\\])', r'\\\1', name) + '%')
+        if vendor:
+            where.append("vendor LIKE ? ESCAPE '\\'")
+            args.append('%' + re.sub(r'([%_\\])', r'\\\1', vendor) + '%')
+        if since is not None:
+            where.append('last_seen >= ?')
+            args.append(since)
+        if until is not None:
+            where.append('first_seen <= ?')
+            args.append(until)
+        if bbox is not None:
+            min_lon, min_lat, max_lon, max_lat = bbox
+            where.append('latitude BETWEEN ? AND ? AND longitude BETWEEN ? AND ?')
+            args += [min_lat, max_lat, min_lon, max_lon]
+        clause = f"WHERE {' AND '.join(where)}" if where else ''
+        order = f"{SORT_COLUMNS.get(sort, 'last_seen')} {'ASC' if direction == 'asc' else 'DESC'}, mac"
+        with self._lock:
+            total = self._db.execute(f'SELECT count(*) FROM devices {clause}', args).fetchone()[0]
+            rows = self._db.execute(f'SELECT * FROM devices {clause} ORDER BY {order} LIMIT ? OFFSET ?',
+                                    args + [limit, offset]).fetchall()
+        return total, [dict(row) for row in rows]
+
+    def map_clusters(self, zoom, bbox=None):
+        # deep zooms without a grid are aggregated from the devices_position index, a request
+        # without a bbox falls back to the deepest grid instead of reading every position
+        zoom = min(max(int(zoom), CLUSTER_MIN_ZOOM), CLUSTER_MAX_ZOOM)
+        if zoom <= CLUSTER_GRID_MAX_ZOOM or bbox is None:
+            return self.clusters.clusters(zoom, bbox)
+        min_lon, min_lat, max_lon, max_lat = bbox
+        with self._lock:
+            rows = self._db.execute('SELECT latitude, longitude FROM devices '
+                                    'WHERE latitude BETWEEN ? AND ? AND longitude BETWEEN ? AND ?',
+                                    (min_lat, max_lat, min_lon, max_lon)).fetchall()
+        return zoom, DeviceClusters.aggregate(((row[0], row[1]) for row in rows), zoom)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
 class BTLog(plugins.Plugin):
     __author__ = 'NeonLightning'
     __version__ = '1.0.4'
@@ -23,9 +847,20 @@ class BTLog(plugins.Plugin):
         self.display = self.options.get('display', False)
         self.gps_track = self.options.get('gps_track', True)
         self.id_only = self.options.get('id_only', True)
+        self.compact_interval = self.options.get('compact_interval', 3600)
+        self.batch_size = max(1, int(self.options.get('batch_size', SCAN_BATCH_SIZE)))
+        self.scan_queue = queue.Queue(maxsize=max(1, int(self.options.get('queue_size', SCAN_QUEUE_SIZE))))
+        self.dropped = 0
+        self.process = None
         self.count = 0
+        self.log_lock = threading.Lock()
+        self.log_dirty = False
+        self.stop_event = threading.Event()
         self.interim_file = '/root/.btinterim.log'
         self.output = '/root/bluetooth.log'
+        self.db_path = self.options.get('db_path', '/root/.btlogger.db')
+        self.oui_path = self.options.get('oui_path', '/usr/share/ieee-data/oui.txt')
+        self.oui_index = self.options.get('oui_index', '/root/.btlogger.oui')
         try:
             with open(self.output, 'r') as log_file:
                 if isinstance(log_file, io.TextIOBase):
@@ -34,12 +869,38 @@ class BTLog(plugins.Plugin):
             with open(self.output, 'w'):
                 self.count = 0
                 pass
+        self.sightings = SightingIndex(self.interim_file)
+        self.vendors = OuiTable(self.oui_path, self.oui_index)
+        self.store = SightingStore(self.db_path, self.output, self.vendors)
+        self.track = None
+        if self.gps and self.gps_track:
+            self.track = TrackRecorder(self.options.get('track_dir', '/root/bt-track'),
+                                       interval=self.options.get('track_interval', 5),
+                                       min_distance=self.options.get('track_min_distance', 10),
+                                       max_gap=self.options.get('track_max_gap', 60),
+                                       segment=self.options.get('track_segment', 3600),
+                                       keep=self.options.get('track_keep', 168),
+                                       keep_jsonl=self.options.get('track_keep_jsonl', False))
         logging.info('[BT-Log] Loaded')
         self.running = True
-        self.log_bluetooth_scan(self.output, self.interim_file)
+        if self.compact_interval:
+            threading.Thread(target=self.run_compaction, daemon=True).start()
+        # bluetoothctl is read on its own thread so gps lookups never hold up its stdout
+        threading.Thread(target=self.read_bluetooth_scan, daemon=True).start()
+        threading.Thread(target=self.log_bluetooth_scan, args=(self.output, self.interim_file), daemon=True).start()
 
     def on_unload(self, ui):
         self.running = False
+        self.stop_event.set()
+        if self.process is not None:
+            try:
+                self.process.terminate()
+            except Exception as e:
+                logging.debug(f"[BT-Log] Error stopping bluetoothctl: {e}")
+        if self.track is not None:
+            self.track.stop()
+        self.store.close()
+        self.vendors.close()
         if self.display == True:
             with ui._lock:
                 try:
@@ -58,84 +919,57 @@ class BTLog(plugins.Plugin):
 
     def on_ui_update(self, ui):
         if self.display == True:
-            try:
-                with open(self.output, 'r') as log_file:
-                    if isinstance(log_file, io.TextIOBase):
-                        self.count = sum(1 for line in log_file)
-            except FileNotFoundError:
-                self.count = 0
-                with open(self.output, 'w'):
-                    pass
             ui.set('bt-log', str(self.count))
         
     def on_webhook(self, path, request):
-        logging.info(f"Received webhook request for path: {path}")
-        log_file_path = '/root/bluetooth.log'
-        devices = []
+        if path == "api/devices":
+            return self.api_devices(request)
+        if path == "api/clusters":
+            return self.api_clusters(request)
+        return render_template_string(TEMPLATE)
+
+    @staticmethod
+    def bbox_arg(args):
+        if not args.get('bbox'):
+            return None
+        bbox = [float(value) for value in args['bbox'].split(',')]
+        if len(bbox) != 4:
+            raise ValueError('bbox must be min_lon,min_lat,max_lon,max_lat')
+        return bbox
+
+    def api_clusters(self, request):
         try:
-            with open(log_file_path, 'r') as log_file:
-                for line in log_file:
-                    match = re.match(r'(.+) ([0-9A-F:]+): (-?\d+\.\d+), (-?\d+\.\d+)', line)
-                    if match:
-                        device_name, mac_address, latitude, longitude = match.groups()
-                        devices.append({
-                            'name': device_name,
-                            'mac': mac_address,
-                            'latitude': latitude,
-                            'longitude': longitude
-                        })
-        except FileNotFoundError:
-            logging.error("Bluetooth log file not found")
-            pass
-        template = '''
-            <!DOCTYPE html>
-            <html lang="en">
-            <head>
-                <meta charset="UTF-8">
-                <meta http-equiv="X-UA-Compatible" content="IE=edge">
-                <meta name="viewport" content="width=device-width, initial-scale=1.0">
-                <title>Bluetooth Devices</title>
-                <style>
-                    table {
-                        width: 100%;
-                        border-collapse: collapse;
-                    }
-                    th, td {
-                        border: 1px solid black;
-                        padding: 8px;
-                        text-align: left;
-                    }
-                    th {
-                        background-color: #f2f2f2;
-                    }
-                </style>
-            </head>
-            <body>
-                <h1>Bluetooth Devices</h1>
-                <table>
-                    <thead>
-                        <tr>
-                            <th>Name</th>
-                            <th>MAC Address</th>
-                            <th>Google Maps</th>
-                        </tr>
-                    </thead>
-                    <tbody>
-                        {% for device in devices %}
-                            <tr>
-                                <td>{{ device.name }}</td>
-                                <td>{{ device.mac }}</td>
-                                <td>
-                                    <a href="https://www.google.com/maps/search/?api=1&query={{ device.latitude }},{{ device.longitude }}">{{ device.latitude }} {{ device.longitude }}</a>
-                                </td>
-                            </tr>
-                        {% endfor %}
-                    </tbody>
-                </table>
-            </body>
-            </html>
-        '''
-        return render_template_string(template, devices=devices)
+            zoom, clusters = self.store.map_clusters(request.args.get('zoom', CLUSTER_MIN_ZOOM, type=int),
+                                                     self.bbox_arg(request.args))
+            return jsonify({"zoom": zoom, "clusters": clusters})
+        except Exception as e:
+            logging.error(f"[BT-Log] Error serving cluster api: {e}")
+            return json.dumps({"status": "error", "message": str(e)}), 500
+
+    def api_devices(self, request):
+        try:
+            args = request.args
+            bbox = self.bbox_arg(args)
+            offset = max(args.get('offset', 0, type=int), 0)
+            total, rows = self.store.query(
+                mac=args.get('mac', '').strip(),
+                name=args.get('name', '').strip(),
+                vendor=args.get('vendor', '').strip(),
+                since=args.get('since', type=float),
+                until=args.get('until', type=float),
+                bbox=bbox,
+                sort=args.get('sort', 'last_seen'),
+                direction=args.get('dir', 'desc'),
+                offset=offset,
+                limit=min(max(args.get('limit', 100, type=int), 1), API_MAX_LIMIT))
+            return jsonify({
+                "total": total,
+                "offset": offset,
+                "rows": rows
+            })
+        except Exception as e:
+            logging.error(f"[BT-Log] Error serving device api: {e}")
+            return json.dumps({"status": "error", "message": str(e)}), 500
 
     def ensure_gpsd_running(self):
         try:
@@ -177,77 +1011,119 @@ class BTLog(plugins.Plugin):
         ansi_escape = re.compile(r'\x1B[@-_][0-?]*[ -/]*[@-~]|\x1B\[.*?[@-~]|\^A\^B')
         return ansi_escape.sub('', text)
 
-    def log_bluetooth_scan(self, output_file, interim_file):
+    def read_bluetooth_scan(self):
         device_pattern = re.compile(r'NEW.*Device ([0-9A-F:]{17}) (.+)')
-        hex_pattern = re.compile(r'^[0-9A-F]{2}-[0-9A-F]{2}-[0-9A-F]{2}-[0-9A-F]{2}-[0-9A-F]{2}-[0-9A-F]{2}$')
-
-        with open(output_file, 'a') as log_file:
-            process = subprocess.Popen(['bluetoothctl'], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
-                                       stderr=subprocess.PIPE, universal_newlines=True)
-            process.stdin.write('scan on\n')
-            process.stdin.flush()
-            while self.running:
-                clean_output = self.remove_ansi_escape_sequences(process.stdout.readline())
-                match = device_pattern.search(clean_output)
-                if match:
-                    mac_address = match.group(1)
-                    device_name = match.group(2)
-                    entry = f"{device_name} {mac_address}"
-                    if not self.is_duplicate(entry, interim_file, latitude, longitude) and (not self.id_only or not hex_pattern.search(device_name)):
-                        latitude, longitude = self.get_gps_coordinates()
-                        if not self.is_duplicate(entry, interim_file, latitude, longitude) and (not self.id_only or not hex_pattern.search(device_name)):
-                            self.count += 1
-                            log_entry = f"{entry}"
-                            logging.info(f"[BT-Log] {log_entry}")
-                            if self.gps:
-                                if latitude is not None and longitude is not None:
-                                    log_entry = f"{log_entry}: {latitude}, {longitude}\n"
-                                else:
-                                    log_entry = f"{entry}: 0, 0\n"
-                            else:
-                                log_entry = f"{entry}\n"
-                            log_file.write(log_entry)
-                            log_file.flush()
-                            with open(interim_file, 'a') as interim:
-                                interim.write(f"{entry} {latitude} {longitude}\n")
-                                interim.flush()
-                            self.organize_bluetooth_log(output_file)
+        try:
+            self.process = subprocess.Popen(['bluetoothctl'], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                            stderr=subprocess.PIPE, universal_newlines=True)
+            self.process.stdin.write('scan on\n')
+            self.process.stdin.flush()
+        except Exception as e:
+            logging.error(f"[BT-Log] Error starting bluetoothctl: {e}")
+            return
+        while self.running:
+            line = self.process.stdout.readline()
+            if not line:
+                break
+            match = device_pattern.search(self.remove_ansi_escape_sequences(line))
+            if match:
+                mac_address = match.group(1)
+                device_name = match.group(2)
+                try:
+                    self.scan_queue.put_nowait((f"{device_name} {mac_address}", time.time()))
+                except queue.Full:
+                    self.dropped += 1
+                    logging.warning(f"[BT-Log] Sighting queue full, dropped {device_name} {mac_address} ({self.dropped} total)")
 
-    def is_duplicate(self, entry, interim_file, latitude, longitude):
+    def next_batch(self):
         try:
-            with open(interim_file, 'r') as interim:
-                for line in interim:
-                    logged_entry, logged_latitude, logged_longitude = line.rsplit(' ', 2)
-                    if logged_entry == entry:
-                        try:
-                            logged_latitude = float(logged_latitude)
-                            logged_longitude = float(logged_longitude)
-                            if latitude is None and longitude is None:
-                                if logged_latitude == 0 and logged_longitude == 0:
-                                    return True
-                            else:
-                                if abs(logged_latitude - latitude) < 0.005 and abs(logged_longitude - longitude) < 0.005:
-                                    return True
-                        except ValueError:
-                            continue
-            return False
-        except FileNotFoundError:
-            with open(interim_file, 'w'):
-                pass
-            return False
+            batch = [self.scan_queue.get(timeout=SCAN_BATCH_WAIT)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.scan_queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def log_bluetooth_scan(self, output_file, interim_file):
+        while self.running:
+            batch = self.next_batch()
+            if not batch:
+                continue
+            if self.track is None:
+                # one fix stamps the whole batch, they were all seen within the same couple of seconds
+                fix = self.get_gps_coordinates()
+            located = []
+            for entry, seen in batch:
+                # with a track the position is interpolated at the moment bluetoothctl reported the device
+                latitude, longitude = self.track.position_at(seen) if self.track is not None else fix
+                if latitude is None or longitude is None:
+                    latitude, longitude = 0, 0
+                located.append((entry, seen, latitude, longitude))
+            try:
+                self.store.record_many([entry.rsplit(' ', 1) + [seen, latitude, longitude]
+                                        for entry, seen, latitude, longitude in located])
+            except Exception as e:
+                logging.error(f"[BT-Log] Error recording sightings: {e}")
+            log_entries = []
+            sightings = []
+            logged = set()
+            for entry, seen, latitude, longitude in located:
+                if entry in logged:
+                    continue
+                logged.add(entry)
+                # unnamed devices still reach the store with their vendor, id_only only keeps them out of the log
+                if self.id_only and HEX_NAME.search(entry.rsplit(' ', 1)[0]):
+                    continue
+                if self.is_duplicate(entry, interim_file, latitude, longitude):
+                    continue
+                logging.info(f"[BT-Log] {entry}")
+                if self.gps:
+                    if latitude is not None and longitude is not None:
+                        log_entries.append(f"{entry}: {latitude}, {longitude}\n")
+                    else:
+                        log_entries.append(f"{entry}: 0, 0\n")
+                else:
+                    log_entries.append(f"{entry}\n")
+                sightings.append((entry, latitude, longitude))
+            if log_entries:
+                try:
+                    self.append_log(output_file, ''.join(log_entries))
+                    self.sightings.add_many(sightings)
+                    self.count += len(log_entries)
+                except Exception as e:
+                    logging.error(f"[BT-Log] Error writing sightings: {e}")
+
+    def is_duplicate(self, entry, interim_file, latitude, longitude):
+        return self.sightings.is_duplicate(entry, latitude, longitude)
+
+    def append_log(self, output_file, log_entry):
+        # opened per write so a compaction swapping the file in never leaves us appending to the old inode
+        with self.log_lock:
+            with open(output_file, 'a') as log_file:
+                log_file.write(log_entry)
+            self.log_dirty = True
+
+    def run_compaction(self):
+        while not self.stop_event.wait(self.compact_interval):
+            if self.log_dirty:
+                self.organize_bluetooth_log(self.output)
 
     def organize_bluetooth_log(self, output_file):
-        hex_pattern = re.compile(r'^[0-9A-F]{2}-[0-9A-F]{2}-[0-9A-F]{2}-[0-9A-F]{2}-[0-9A-F]{2}-[0-9A-F]{2}$')
+        tmp_file = f"{output_file}.tmp"
         try:
-            with open(output_file, 'r') as f:
-                lines = f.readlines()
-            matching_lines = [line for line in lines if hex_pattern.search(line.split()[0])]
-            non_matching_lines = [line for line in lines if not hex_pattern.search(line.split()[0])]
-            matching_lines.sort()
-            non_matching_lines.sort()
-            organized_lines = non_matching_lines + matching_lines
-            with open(output_file, 'w') as f:
-                f.writelines(organized_lines)
+            with self.log_lock:
+                with open(output_file, 'r') as f:
+                    lines = [line for line in f if line.strip()]
+                lines.sort(key=log_sort_key)
+                with open(tmp_file, 'w') as f:
+                    f.writelines(lines)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_file, output_file)
+                self.log_dirty = False
             logging.debug('[BT-Log] Organized bluetooth.log')
         except Exception as e:
-            logging.error(f"[BT-Log] Error organizing bluetooth.log: {e}")
\ No newline at end of file
+            logging.error(f"[BT-Log] Error organizing bluetooth.log: {e}")
@@ -5,6 +5,12 @@
 # main.plugins.sorted-password-list.show_number = True or False
 # this will keep the qr files in /root/handshakes/ when you create one
 # main.plugins.sorted-password-list.keep_qr = True or False
+# this will set which potfiles are listed, format is one of wpa-sec, remote_cracking or hashcat (22000 potfile)
+# main.plugins.sorted-password-list.potfiles = [{path = "/root/handshakes/wpa-sec.cracked.potfile", format = "wpa-sec"}, {path = "/root/hashcat.potfile", format = "hashcat"}]
+# this will set how many seconds an access point counts as nearby after it was last seen
+# main.plugins.sorted-password-list.rssi_ttl = 120
+# this will set how many bytes of qr codes are kept in memory
+# main.plugins.sorted-password-list.qr_cache_bytes = 1048576
 # this will limit the fields displayed in webui to the ones chosen
 # main.plugins.sorted-password-list.fields = ['ssid', 'bssid', 'password', 'origin', 'gps', 'strength']
 # this will set a custom position (X, Y)
@@ -13,13 +19,14 @@
 # main.plugins.sorted-password-list.qr_display = True or False
 # you will need to sudo apt install python3-qrcode or sudo pip install qrcode (pip install only on older versions of pwnagotchi)
 
-import logging, os, json, re, pwnagotchi, tempfile
+import logging, os, io, json, re, pwnagotchi, threading, heapq, time, hashlib
+from collections import OrderedDict
 from pwnagotchi.ui.components import LabeledValue
 from pwnagotchi.ui.view import BLACK
 import pwnagotchi.ui.fonts as fonts
 import pwnagotchi.plugins as plugins
 from pwnagotchi.bettercap import Client
-from flask import render_template_string, send_file
+from flask import render_template_string, jsonify, make_response
 
 TEMPLATE = """
 {% extends "base.html" %}
@@ -38,6 +45,10 @@ TEMPLATE = """
         #searchText {
             width: 100%;
         }
+        #tableContainer {
+            height: 75vh;
+            overflow-y: auto;
+        }
         table {
             table-layout: auto;
             width: 100%;
@@ -50,6 +61,10 @@ TEMPLATE = """
             padding: 15px;
             text-align: left;
         }
+        tr.spacer td {
+            padding: 0;
+            border: none;
+        }
         th.sortable {
             cursor: pointer;
         }
@@ -64,7 +79,7 @@ TEMPLATE = """
             table {
                 border:none;
             }
-            tr:first-child, thead, th {
+            thead, th {
                 display:none;
                 border:none;
             }
@@ -93,16 +108,8 @@ TEMPLATE = """
 {% endblock %}
 {% block script %}
     function handlePasswordClick(password, ssid, bssid) {
-        alert("One Moment");
-        const csrfToken = document.querySelector('meta[name="csrf-token"]').getAttribute('content');
-        fetch('/plugins/sorted-password-list', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-                'X-CSRFToken': csrfToken
-            },
-            body: JSON.stringify({ password: password, ssid: ssid, bssid: bssid })
-        })
+        var params = new URLSearchParams({ ssid: ssid, bssid: bssid, password: password });
+        fetch('/plugins/sorted-password-list/qr?' + params.toString())
         .then(response => {
             if (response.ok && response.headers.get("Content-Type").includes("image/png")) {
                 return response.blob();
@@ -120,148 +127,520 @@ TEMPLATE = """
         })
         .catch(error => console.error('Error:', error));
     }
+    // only the rows around the visible window are fetched, sorting and filtering happen on the unit
+    var columns = {{ columns|tojson }};
+    var qrDisplay = {{ qr_display|tojson }};
+    var container = document.getElementById("tableContainer");
+    var tbody = document.getElementById("tableBody");
     var searchInput = document.getElementById("searchText");
-    searchInput.onkeyup = function() {
-        var filter, table, tr, td, i, txtValue;
-        filter = searchInput.value.toUpperCase();
-        table = document.getElementById("tableOptions");
-        if (table) {
-            tr = table.getElementsByTagName("tr");
-            for (i = 0; i < tr.length; i++) {
-                td = tr[i].getElementsByTagName("td")[0];
-                if (td) {
-                    txtValue = td.textContent || td.innerText;
-                    if (txtValue.toUpperCase().indexOf(filter) > -1) {
-                        tr[i].style.display = "";
-                    } else {
-                        tr[i].style.display = "none";
-                    }
-                }
-            }
+    var state = { sort: "", dir: "", search: "", total: 0, offset: -1, rows: [] };
+    var rowHeight = 50;
+    var overscan = 20;
+    var requestSeq = 0;
+    var scrollTimer = null;
+    var searchTimer = null;
+
+    function makeCell(label, content) {
+        var td = document.createElement("td");
+        td.setAttribute("data-label", label);
+        if (content instanceof Node) {
+            td.appendChild(content);
+        } else {
+            td.textContent = content;
         }
+        return td;
     }
-    function sortTable(columnIndex, defaultDirection = 'asc') {
-        var table, rows, switching, i, x, y, shouldSwitch, dir, switchcount = 0;
-        table = document.getElementById("tableOptions");
-        switching = true;
-        dir = defaultDirection;
-        while (switching) {
-            switching = false;
-            rows = table.rows;
-            for (i = 1; i < (rows.length - 1); i++) {
-                shouldSwitch = false;
-                x = rows[i].getElementsByTagName("TD")[columnIndex];
-                y = rows[i + 1].getElementsByTagName("TD")[columnIndex];
-
-                if (dir === "asc") {
-                    if (x.textContent.toLowerCase() > y.textContent.toLowerCase()) {
-                        shouldSwitch = true;
-                        break;
-                    }
-                } else if (dir === "desc") {
-                    if (x.textContent.toLowerCase() < y.textContent.toLowerCase()) {
-                        shouldSwitch = true;
-                        break;
-                    }
+    function makeRow(p) {
+        var tr = document.createElement("tr");
+        columns.forEach(function(col) {
+            if (col.key === "password" && qrDisplay) {
+                var a = document.createElement("a");
+                a.href = "#";
+                a.textContent = p.password;
+                a.onclick = function(e) {
+                    e.preventDefault();
+                    handlePasswordClick(p.password, p.ssid, p.bssid);
+                };
+                tr.appendChild(makeCell(col.label, a));
+            } else if (col.key === "gps") {
+                if (p.lat && p.lng) {
+                    var link = document.createElement("a");
+                    link.href = p.google_maps_link;
+                    link.target = "_blank";
+                    link.textContent = p.lat + ", " + p.lng;
+                    tr.appendChild(makeCell(col.label, link));
+                } else {
+                    tr.appendChild(makeCell(col.label, "no gps.json found"));
                 }
-            }
-            if (shouldSwitch) {
-                rows[i].parentNode.insertBefore(rows[i + 1], rows[i]);
-                switching = true;
-                switchcount++;
+            } else if (col.key === "strength") {
+                tr.appendChild(makeCell(col.label, p.rssi !== null ? p.rssi : "not nearby"));
+            } else if (col.key === "origin") {
+                tr.appendChild(makeCell(col.label, p.filename));
             } else {
-                if (switchcount === 0 && dir === "asc") {
-                    dir = "desc";
-                    switching = true;
-                }
+                tr.appendChild(makeCell(col.label, p[col.key]));
             }
+        });
+        return tr;
+    }
+    function makeSpacer(height) {
+        var tr = document.createElement("tr");
+        tr.className = "spacer";
+        var td = document.createElement("td");
+        td.colSpan = columns.length;
+        td.style.height = height + "px";
+        tr.appendChild(td);
+        return tr;
+    }
+    function render() {
+        var fragment = document.createDocumentFragment();
+        var offset = Math.max(state.offset, 0);
+        fragment.appendChild(makeSpacer(offset * rowHeight));
+        state.rows.forEach(function(p) {
+            fragment.appendChild(makeRow(p));
+        });
+        fragment.appendChild(makeSpacer(Math.max(state.total - offset - state.rows.length, 0) * rowHeight));
+        tbody.replaceChildren(fragment);
+        var first = tbody.querySelector("tr:not(.spacer)");
+        if (first && first.offsetHeight > 0 && Math.abs(first.offsetHeight - rowHeight) > 1) {
+            rowHeight = first.offsetHeight;
+            render();
         }
     }
-    function defaultSort() {
-        var rssiColumnIndex = 5;
-        var ssidColumnIndex = 0;
-        var table = document.getElementById("tableOptions");
-        var hasRSSI = Array.from(table.getElementsByTagName("tr")).some(function(row) {
-            return row.getElementsByTagName("td")[rssiColumnIndex] && row.getElementsByTagName("td")[rssiColumnIndex].textContent.trim() !== "not nearby";
+    function loadRows(force) {
+        var visible = Math.ceil(container.clientHeight / rowHeight);
+        var offset = Math.max(Math.floor(container.scrollTop / rowHeight) - overscan, 0);
+        if (!force && state.offset >= 0 && offset >= state.offset &&
+            offset + visible <= state.offset + state.rows.length + overscan) {
+            return;
+        }
+        var params = new URLSearchParams({
+            offset: offset,
+            limit: visible + 2 * overscan,
+            sort: state.sort,
+            dir: state.dir,
+            search: state.search
         });
-        sortTable(hasRSSI ? rssiColumnIndex : ssidColumnIndex);
+        var seq = ++requestSeq;
+        fetch('/plugins/sorted-password-list/api/passwords?' + params.toString())
+            .then(response => response.json())
+            .then(data => {
+                if (seq !== requestSeq) {
+                    return;
+                }
+                state.sort = data.sort;
+                state.dir = data.dir;
+                state.total = data.total;
+                state.offset = data.offset;
+                state.rows = data.rows;
+                render();
+            })
+            .catch(error => console.error('Error:', error));
     }
-    window.onload = defaultSort;
-    document.querySelectorAll("th.sortable").forEach(function(th, index) {
+    container.addEventListener("scroll", function() {
+        clearTimeout(scrollTimer);
+        scrollTimer = setTimeout(function() { loadRows(false); }, 50);
+    });
+    searchInput.onkeyup = function() {
+        clearTimeout(searchTimer);
+        searchTimer = setTimeout(function() {
+            if (state.search === searchInput.value) {
+                return;
+            }
+            state.search = searchInput.value;
+            container.scrollTop = 0;
+            loadRows(true);
+        }, 250);
+    }
+    document.querySelectorAll("th.sortable").forEach(function(th) {
         th.addEventListener("click", function() {
-            sortTable(index);
+            var key = th.getAttribute("data-sort");
+            state.dir = (state.sort === key && state.dir === "asc") ? "desc" : "asc";
+            state.sort = key;
+            container.scrollTop = 0;
+            loadRows(true);
         });
     });
+    window.onload = function() { loadRows(true); };
 {% endblock %}
 {% block content %}
     <input type="text" id="searchText" placeholder="Search for ..." title="Type in a filter">
-    <table id="tableOptions">
-        <tr>
-            {% if ssid_display %}
-                <th class="sortable">SSID</th>
-            {% endif %}
-            {% if bssid_display %}
-                <th class="sortable">BSSID</th>
-            {% endif %}
-            {% if password_display %}
-                <th class="sortable">Password</th>
-            {% endif %}
-            {% if origin_display %}
-                <th class="sortable">Origin</th>
-            {% endif %}
-            {% if gps_display %}
-                <th class="sortable">GPS</th>
-            {% endif %}
-            {% if strength_display %}
-                <th class="sortable">Strength</th>
-            {% endif %}
-        </tr>
-        {% for p in passwords %}
-            <tr>
-                {% if ssid_display %}
-                    <td data-label="SSID">{{ p["ssid"] }}</td>
-                {% endif %}
-                {% if bssid_display %}
-                    <td data-label="BSSID">{{ p["bssid"] }}</td>
-                {% endif %}
-                {% if password_display %}
-                    <td data-label="Password">
-                        {% if qr_display %}
-                            <a href="#" onclick="handlePasswordClick('{{ p['password'] }}', '{{ p['ssid'] }}', '{{ p['bssid'] }}')">
-                                {{ p["password"] }}
-                            </a>
-                        {% else %}
-                            {{ p["password"] }}
-                        {% endif %}
-                    </td>
-                {% endif %}
-                {% if origin_display %}
-                    <td data-label="Origin">{{ p["filename"] }}</td>
-                {% endif %}
-                {% if gps_display %}
-                    <td data-label="GPS">
-                        {% if p["lat"] and p["lng"] %}
-                            <a href="{{ p["google_maps_link"] }}" target="_blank">{{ p["lat"] }}, {{ p["lng"] }}</a>
-                        {% else %}
-                            no gps.json found
-                        {% endif %}
-                    </td>
-                {% endif %}
-                {% if strength_display %}
-                    <td data-label="Strength">
-                        {% if p["rssi"] %}
-                            {{ p["rssi"] }}
-                        {% else %}
-                            not nearby
-                        {% endif %}
-                    </td>
-                {% endif %}
-            </tr>
-        {% endfor %}
-    </table>
+    <div id="tableContainer">
+        <table id="tableOptions">
+            <thead>
+                <tr>
+                    {% for col in columns %}
+                        <th class="sortable" data-sort="{{ col.key }}">{{ col.label }}</th>
+                    {% endfor %}
+                </tr>
+            </thead>
+            <tbody id="tableBody">
+            </tbody>
+        </table>
+    </div>
 {% endblock %}
 """
 
+COLUMNS = [
+    ('ssid', 'SSID'),
+    ('bssid', 'BSSID'),
+    ('password', 'Password'),
+    ('origin', 'Origin'),
+    ('gps', 'GPS'),
+    ('strength', 'Strength'),
+]
+
+SORT_KEYS = {
+    'ssid': lambda p: p['ssid'].lower(),
+    'bssid': lambda p: p['bssid'].lower(),
+    'password': lambda p: p['password'].lower(),
+    'origin': lambda p: p['filename'].lower(),
+    'gps': lambda p: (p['lat'], p['lng']) if p['lat'] is not None and p['lng'] is not None else None,
+    'strength': lambda p: p['rssi'],
+}
+
+API_MAX_LIMIT = 500
+
+
+def _decode_essid(essid, hexed=False):
+    if essid.startswith('$HEX[') and essid.endswith(']'):
+        essid, hexed = essid[5:-1], True
+    if hexed:
+        return bytes.fromhex(essid).decode('utf-8', errors='replace')
+    return essid
+
+
+def _parse_wpasec_line(line):
+    # bssid:station:ssid:password
+    fields = line.split(":", 3)
+    return fields[0], fields[2], fields[3]
+
+
+def _parse_remote_cracking_line(line):
+    # hash:bssid:station:ssid:password
+    fields = line.split(":", 4)
+    return fields[1], fields[3], fields[4]
+
+
+def _parse_hashcat_line(line):
+    # hashcat 22000 potfile, either hash*bssid*station*essid_hex:password (optionally the full WPA*0x* line)
+    # or the --show style hash:bssid:station:essid:password
+    first, _, password = line.partition(":")
+    if '*' in first:
+        parts = first.split('*')
+        if parts[0] == 'WPA':
+            parts = parts[2:]
+        return parts[1], _decode_essid(parts[3], hexed=True), password
+    fields = line.split(":", 4)
+    return fields[1], _decode_essid(fields[3]), fields[4]
+
+
+POTFILE_FORMATS = {
+    'wpa-sec': _parse_wpasec_line,
+    'remote_cracking': _parse_remote_cracking_line,
+    'hashcat': _parse_hashcat_line,
+}
+
+DEFAULT_POTFILES = [
+    {'path': '/root/handshakes/wpa-sec.cracked.potfile', 'format': 'wpa-sec'},
+    {'path': '/root/handshakes/remote_cracking.potfile', 'format': 'remote_cracking'},
+]
+
+
+class PotfileIndex:
+    # keeps the parsed potfiles in memory and only reads what was appended since the last refresh.
+    # each potfile is tracked by inode and byte offset, a rotated or truncated file rebuilds everything.
+    # sources are read line by line into per-source sorted runs which are k-way merged into the
+    # ssid ordered list, so no source is ever held in memory beyond its new unique entries.
+    TAIL_CHECK = 64
+    TAIL_SETTLE = 5
+
+    def __init__(self, sources):
+        self.sources = sources
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._state = {}
+        self._entries = {}
+        self._sorted = []
+        self._seq = 0
+
+    def __len__(self):
+        return len(self._sorted)
+
+    def refresh(self):
+        with self._lock:
+            if self._needs_rebuild():
+                logging.info("[Sorted-Password-List] potfile rotated or truncated, rebuilding index")
+                self._reset()
+            runs = []
+            for path, filename, parser in self.sources:
+                if os.path.exists(path):
+                    run = self._read_new(path, filename, parser)
+                    if run:
+                        run.sort(key=self._sort_key)
+                        runs.append(run)
+            if runs:
+                self._sorted = list(heapq.merge(self._sorted, *runs, key=self._sort_key))
+
+    def passwords(self):
+        self.refresh()
+        with self._lock:
+            return [dict(p) for _, _, p in self._sorted]
+
+    def contains(self, bssid, ssid, password):
+        self.refresh()
+        with self._lock:
+            return (bssid.replace(':', '').lower(), ssid, password) in self._entries
+
+    @staticmethod
+    def _sort_key(item):
+        return item[0], item[1]
+
+    def _needs_rebuild(self):
+        for path, _, _ in self.sources:
+            state = self._state.get(path)
+            if state is None:
+                continue
+            inode, offset, tail, _ = state
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                return True
+            if st.st_ino != inode or st.st_size < offset:
+                return True
+            if tail:
+                with open(path, 'rb') as file_in:
+                    file_in.seek(offset - len(tail))
+                    if file_in.read(len(tail)) != tail:
+                        return True
+        return False
+
+    def _read_new(self, path, filename, parser):
+        run = []
+        with open(path, 'rb') as file_in:
+            st = os.fstat(file_in.fileno())
+            inode = st.st_ino
+            _, offset, tail, pending = self._state.get(path, (inode, 0, b'', None))
+            file_in.seek(offset)
+            for raw in file_in:
+                # a last line without newline may still be being written. it is consumed once the file
+                # kept its size since the previous refresh or was not modified for TAIL_SETTLE seconds
+                if not raw.endswith(b'\n'):
+                    if pending != st.st_size and time.time() - st.st_mtime < self.TAIL_SETTLE:
+                        pending = st.st_size
+                        break
+                pending = None
+                offset += len(raw)
+                tail = (tail + raw)[-self.TAIL_CHECK:]
+                line = raw.decode('utf-8', errors='replace').strip()
+                if not line:
+                    continue
+                try:
+                    bssid, ssid, password = parser(line)
+                except (IndexError, ValueError):
+                    logging.debug(f"[Sorted-Password-List] skipping malformed potfile line in {filename}")
+                    continue
+                item = self._add((bssid.replace(':', '').lower(), ssid, password), filename)
+                if item is not None:
+                    run.append(item)
+        self._state[path] = (inode, offset, tail, pending)
+        return run
+
+    def _add(self, entry, filename):
+        if entry in self._entries:
+            return None
+        password = {
+            "ssid": entry[1],
+            "bssid": entry[0],
+            "password": entry[2],
+            "filename": filename,
+            "lat": None,
+            "lng": None,
+            "google_maps_link": None,
+            "rssi": None
+        }
+        self._entries[entry] = password
+        self._seq += 1
+        return entry[1], self._seq, password
+
+
+class GpsIndex:
+    # maps (ssid, bssid) to the coordinates stored in the handshakes .gps.json sidecars.
+    # the directory is only rescanned when its mtime changes, sidecars rewritten in place
+    # are caught by a periodic stat of the known files.
+    SUFFIX = '.gps.json'
+
+    def __init__(self, directory, recheck_interval=30):
+        self.directory = directory
+        self.recheck_interval = recheck_interval
+        self._lock = threading.Lock()
+        self._dir_mtime = None
+        self._last_check = 0
+        self._files = {}
+        self._locations = {}
+
+    def refresh(self):
+        with self._lock:
+            try:
+                dir_mtime = os.stat(self.directory).st_mtime_ns
+            except FileNotFoundError:
+                self._dir_mtime = None
+                self._files = {}
+                self._locations = {}
+                return
+            now = time.monotonic()
+            if dir_mtime != self._dir_mtime:
+                self._scan()
+                self._dir_mtime = dir_mtime
+                self._last_check = now
+            elif now - self._last_check >= self.recheck_interval:
+                self._recheck()
+                self._last_check = now
+
+    def lookup(self, ssid, bssid):
+        location = self._locations.get((re.sub(r'\W+', '', ssid), bssid))
+        if location is None:
+            return None, None, None
+        lat, lng = location
+        return lat, lng, f"https://www.google.com/maps?q={lat},{lng}"
+
+    def _scan(self):
+        files = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.name.endswith(self.SUFFIX) or not entry.is_file():
+                    continue
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files[entry.name] = (st.st_mtime_ns, st.st_size)
+        for name in self._files.keys() - files.keys():
+            self._locations.pop(self._key(name), None)
+        for name, signature in files.items():
+            if self._files.get(name) != signature:
+                self._load(name)
+        self._files = files
+
+    def _recheck(self):
+        for name, signature in list(self._files.items()):
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                del self._files[name]
+                self._locations.pop(self._key(name), None)
+                continue
+            current = (st.st_mtime_ns, st.st_size)
+            if current != signature:
+                self._files[name] = current
+                self._load(name)
+
+    def _key(self, name):
+        stem = name[:-len(self.SUFFIX)]
+        ssid, _, bssid = stem.rpartition('_')
+        return ssid, bssid
+
+    def _load(self, name):
+        key = self._key(name)
+        self._locations.pop(key, None)
+        try:
+            with open(os.path.join(self.directory, name), 'r') as geo_file:
+                data = json.load(geo_file)
+        except (OSError, ValueError) as e:
+            logging.debug(f"[Sorted-Password-List] could not read {name}: {e}")
+            return
+        if isinstance(data, dict):
+            lat = data.get('Latitude') or data.get('location', {}).get('lat')
+            lng = data.get('Longitude') or data.get('location', {}).get('lng')
+            if lat is not None and lng is not None:
+                self._locations[key] = (lat, lng)
+
+
+class QrCache:
+    # size bounded lru of rendered wifi qr pngs keyed by (ssid, password).
+    # with disk_dir set the pngs are also kept in the handshakes directory and read back on a miss.
+    def __init__(self, max_bytes=1024 * 1024, disk_dir=None):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._size = 0
+
+    def get(self, ssid, bssid, password):
+        key = (ssid, password)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+        png = None
+        png_filepath = None
+        if self.disk_dir:
+            # only word characters from the network end up in the name, the hash tells passwords apart
+            digest = hashlib.sha1(f'{ssid}\0{bssid}\0{password}'.encode('utf-8')).hexdigest()[:12]
+            safe_ssid = re.sub(r'\W+', '', ssid)
+            safe_bssid = re.sub(r'\W+', '', bssid)
+            png_filepath = os.path.join(self.disk_dir, f'{safe_ssid}_{safe_bssid}_{digest}.png')
+            if os.path.exists(png_filepath):
+                with open(png_filepath, 'rb') as png_file:
+                    png = png_file.read()
+        if png is None:
+            png = self._render(ssid, password)
+            if png_filepath:
+                with open(png_filepath, 'wb') as png_file:
+                    png_file.write(png)
+        entry = (png, hashlib.sha1(png).hexdigest())
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = entry
+                self._size += len(png)
+                while self._size > self.max_bytes and len(self._entries) > 1:
+                    _, (old_png, _) = self._entries.popitem(last=False)
+                    self._size -= len(old_png)
+        return entry
+
+    def _render(self, ssid, password):
+        import qrcode
+        qr_data = f"WIFI:T:WPA;S:{ssid};P:{password};;"
+        qr_code = qrcode.QRCode(
+            error_correction=qrcode.constants.ERROR_CORRECT_L,
+            box_size=10,
+            border=4,
+        )
+        qr_code.add_data(qr_data)
+        qr_code.make(fit=True)
+        img = qr_code.make_image(fill_color="yellow", back_color="black")
+        buffer = io.BytesIO()
+        img.save(buffer)
+        return buffer.getvalue()
+
+
+class RssiTable:
+    # last seen signal strength per bssid, fed from the agent's access point callbacks.
+    # entries older than ttl seconds are treated as not nearby and dropped.
+    def __init__(self, ttl=120):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def update(self, access_points):
+        now = time.monotonic()
+        with self._lock:
+            for ap in access_points:
+                bssid = ap.get('mac')
+                if not bssid or ap.get('hostname') == "<hidden>":
+                    continue
+                self._entries[bssid.replace(':', '').lower()] = (ap.get('rssi'), now)
+
+    def snapshot(self):
+        now = time.monotonic()
+        with self._lock:
+            stale = [bssid for bssid, (_, seen) in self._entries.items() if now - seen > self.ttl]
+            for bssid in stale:
+                del self._entries[bssid]
+            return {bssid: rssi for bssid, (rssi, _) in self._entries.items()}
+
 
 class SortedPasswordList(plugins.Plugin):
     __author__ = 'neonlightning'
@@ -276,9 +655,12 @@ class SortedPasswordList(plugins.Plugin):
         self.qr_display = False
         self.fields = ['ssid', 'bssid', 'password', 'origin', 'gps', 'strength']
         self.sorted_aps = []
-        self.rssi_data = {}
+        self.rssi_data = RssiTable()
         self._agent = None
         self.keep_qr = False
+        self.potfiles = PotfileIndex(self._potfile_sources(DEFAULT_POTFILES))
+        self.gps_index = GpsIndex('/root/handshakes')
+        self.qr_cache = QrCache()
 
     def on_ready(self, agent):
         self._agent = agent
@@ -294,6 +676,10 @@ class SortedPasswordList(plugins.Plugin):
             self.fields = self.options.get('fields', ['ssid', 'bssid', 'password', 'origin', 'gps', 'strength'])
             self.show_number = self.options.get('show_number', True)
             self.keep_qr = self.options.get('keep_qr', False)
+            self.rssi_data.ttl = self.options.get('rssi_ttl', 120)
+            self.potfiles = PotfileIndex(self._potfile_sources(self.options.get('potfiles', DEFAULT_POTFILES)))
+            self.qr_cache = QrCache(max_bytes=self.options.get('qr_cache_bytes', 1024 * 1024),
+                                    disk_dir='/root/handshakes' if self.keep_qr else None)
             self.ssid_display = 'ssid' in self.fields
             self.bssid_display = 'bssid' in self.fields
             self.password_display = 'password' in self.fields
@@ -308,157 +694,130 @@ class SortedPasswordList(plugins.Plugin):
         except Exception as e:
             logging.exception(f"[Sorted-Password-List] error setting up: {e}")
 
+    def _potfile_sources(self, potfiles):
+        sources = []
+        for potfile in potfiles:
+            path = potfile.get('path')
+            parser = POTFILE_FORMATS.get(potfile.get('format'))
+            if not path or parser is None:
+                logging.error(f"[Sorted-Password-List] skipping potfile with unknown path or format: {potfile}")
+                continue
+            sources.append((path, os.path.basename(path), parser))
+        return sources
+
     def _load_passwords(self, with_location=False):
-        passwords = []
         try:
-            lineswpa = []
-            linesrc = []
-            if os.path.exists('/root/handshakes/wpa-sec.cracked.potfile'):
-                with open('/root/handshakes/wpa-sec.cracked.potfile', 'r') as file_in:
-                    lineswpa = [(line.strip(), 'wpa-sec.cracked.potfile') for line in file_in.readlines() if line.strip()]
-            if os.path.exists('/root/handshakes/remote_cracking.potfile'):
-                with open('/root/handshakes/remote_cracking.potfile', 'r') as file_in:
-                    linesrc = [(line.strip(), 'remote_cracking.potfile') for line in file_in.readlines() if line.strip()]
-            if not lineswpa and not linesrc:
+            passwords = self.potfiles.passwords()
+            if not passwords:
                 logging.info("[Sorted-Password-List] no potfiles found")
-                return []
-            unique_lines = set()
-            for line, filename in lineswpa:
-                fields = line.split(":")
-                entry = (fields[0], fields[2], fields[3])
-                if entry not in unique_lines:
-                    unique_lines.add(entry)
-                    passwords.append({
-                        "ssid": entry[1],
-                        "bssid": entry[0],
-                        "password": entry[2],
-                        "filename": filename,
-                        "lat": None,
-                        "lng": None,
-                        "google_maps_link": None,
-                        "rssi": None
-                    })
-            for line, filename in linesrc:
-                fields = line.split(":")
-                entry = (fields[1], fields[3], fields[4])
-                if entry not in unique_lines:
-                    unique_lines.add(entry)
-                    passwords.append({
-                        "ssid": entry[1],
-                        "bssid": entry[0],
-                        "password": entry[2],
-                        "filename": filename,
-                        "lat": None,
-                        "lng": None,
-                        "google_maps_link": None,
-                        "rssi": None
-                    })
-            return sorted(passwords, key=lambda x: x["ssid"])
+            return passwords
         except Exception as err:
             logging.exception(f"[Sorted-Password-List] error while loading passwords: {repr(err)}")
             return []
 
     def _get_location_info(self, ssid, bssid):
-        ssid = re.sub(r'\W+', '', ssid)
-        geojson_file = (f"/root/handshakes/{ssid}_{bssid}.gps.json")
-        if os.path.exists(geojson_file):
-            with open(geojson_file, 'r') as geo_file:
-                data = json.load(geo_file)
-            if data is not None:
-                lat = data.get('Latitude') or data.get('location', {}).get('lat')
-                lng = data.get('Longitude') or data.get('location', {}).get('lng')
-                if lat is not None and lng is not None:
-                    google_maps_link = f"https://www.google.com/maps?q={lat},{lng}"
-                    return lat, lng, google_maps_link
-        return None, None, None
-
-    def _get_rssi(self):
-        try:
-            if self._agent:
-                wifi_info = self._agent.session(sess="session/wifi")
-                aps = wifi_info.get('aps', [])
-                if aps:
-                    for ap in aps:
-                        rssi = ap.get('rssi')
-                        ssid = ap.get('hostname')
-                        bssid = ap.get('mac')
-                        bssid = bssid.replace(':', '')
-                        if ssid != "<hidden>":
-                            self.rssi_data[bssid] = rssi
-        except Exception as e:
-            logging.error(f"[Sorted-Password-List] Exception encountered: {e}")
+        return self.gps_index.lookup(ssid, bssid)
+
+    def on_unfiltered_ap_list(self, agent, access_points):
+        if self.strength_display:
+            try:
+                self.rssi_data.update(access_points)
+            except Exception as e:
+                logging.error(f"[Sorted-Password-List] Exception encountered: {e}")
 
     def on_webhook(self, path, request):
         if self.qr_display:
-            import qrcode
             if request.method == "POST":
                 try:
-                    try:
-                        data = request.json
-                        password = data.get('password')
-                        ssid = data.get('ssid')
-                        bssid = data.get('bssid')
-                        png_filepath = f'/root/handshakes/{ssid}_{bssid}_{password}.png'
-                        if self.keep_qr:
-                            if os.path.exists(png_filepath):
-                                response = send_file(png_filepath, mimetype='image/png')
-                            else:
-                                qr_data = f"WIFI:T:WPA;S:{ssid};P:{password};;"
-                                qr_code = qrcode.QRCode(
-                                    error_correction=qrcode.constants.ERROR_CORRECT_L,
-                                    box_size=10,
-                                    border=4,
-                                )
-                                qr_code.add_data(qr_data)
-                                qr_code.make(fit=True)
-                                img = qr_code.make_image(fill_color="yellow", back_color="black")
-                                img.save(png_filepath)
-                                response = send_file(png_filepath, mimetype='image/png')
-                        else:
-                            with tempfile.NamedTemporaryFile(delete=False, suffix='.png', prefix='WIFIQR') as temp_file:
-                                png_filepath = temp_file.name
-                                qr_data = f"WIFI:T:WPA;S:{ssid};P:{password};;"
-                                qr_code = qrcode.QRCode(
-                                    error_correction=qrcode.constants.ERROR_CORRECT_L,
-                                    box_size=10,
-                                    border=4,
-                                )
-                                qr_code.add_data(qr_data)
-                                qr_code.make(fit=True)
-                                img = qr_code.make_image(fill_color="yellow", back_color="black")
-                                img.save(png_filepath)
-                                response = send_file(png_filepath, mimetype='image/png')
-                        return response
-                    finally:
-                        if not self.keep_qr:
-                            if os.path.exists(png_filepath):
-                                os.remove(png_filepath)
+                    data = request.json
+                    return self._qr_response(request, data.get('ssid'), data.get('bssid'), data.get('password'))
                 except Exception as e:
                     logging.error(f"[Sorted-Password-List] Error processing password click: {e}")
                     return json.dumps({"status": "error", "message": str(e)}), 500
+            if path == "qr":
+                try:
+                    args = request.args
+                    return self._qr_response(request, args.get('ssid', ''), args.get('bssid', ''), args.get('password', ''))
+                except Exception as e:
+                    logging.error(f"[Sorted-Password-List] Error processing password click: {e}")
+                    return json.dumps({"status": "error", "message": str(e)}), 500
+        if path == "api/passwords":
+            return self._api_passwords(request)
         if path == "/" or not path:
-            if self.strength_display:
-                self._get_rssi()
-            passwords = self._load_passwords(with_location=False)
-            for p in passwords:
-                if self.gps_display:
-                    lat, lng, google_maps_link = self._get_location_info(p['ssid'], p['bssid'])
-                    p["lat"] = lat
-                    p["lng"] = lng
-                    p["google_maps_link"] = google_maps_link
-                    p["rssi"] = self.rssi_data.get(p['bssid'], 'Not Nearby')
+            columns = [{"key": key, "label": label} for key, label in COLUMNS if key in self.fields]
             return render_template_string(TEMPLATE,
                                           title="Passwords list",
-                                          passwords=passwords,
-                                          qr_display=self.qr_display,
-                                          ssid_display=self.ssid_display,
-                                          bssid_display=self.bssid_display,
-                                          password_display=self.password_display,
-                                          origin_display=self.origin_display,
-                                          gps_display=self.gps_display,
-                                          strength_display=self.strength_display
+                                          columns=columns,
+                                          qr_display=self.qr_display
                                           )
 
+    def _qr_response(self, request, ssid, bssid, password):
+        # only networks from the potfiles are rendered, anything else could be made up by another page
+        if not self.potfiles.contains(bssid or '', ssid or '', password or ''):
+            return json.dumps({"status": "error", "message": "unknown network"}), 404
+        png, etag = self.qr_cache.get(ssid, bssid, password)
+        response = make_response(png)
+        response.mimetype = 'image/png'
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response.make_conditional(request)
+
+    def _passwords_with_info(self):
+        passwords = self._load_passwords(with_location=False)
+        rssi_data = self.rssi_data.snapshot() if self.strength_display else {}
+        if self.gps_display:
+            try:
+                self.gps_index.refresh()
+            except Exception as e:
+                logging.error(f"[Sorted-Password-List] error indexing gps files: {e}")
+        for p in passwords:
+            if self.gps_display:
+                lat, lng, google_maps_link = self._get_location_info(p['ssid'], p['bssid'])
+                p["lat"] = lat
+                p["lng"] = lng
+                p["google_maps_link"] = google_maps_link
+            if self.strength_display:
+                p["rssi"] = rssi_data.get(p['bssid'].lower())
+        return passwords
+
+    def _sort_passwords(self, passwords, sort, direction):
+        # entries without a value for the column (no gps, not nearby) always go last
+        key = SORT_KEYS[sort]
+        present = [p for p in passwords if key(p) is not None]
+        missing = [p for p in passwords if key(p) is None]
+        present.sort(key=key, reverse=direction == 'desc')
+        return present + missing
+
+    def _api_passwords(self, request):
+        try:
+            offset = max(request.args.get('offset', 0, type=int), 0)
+            limit = min(max(request.args.get('limit', 100, type=int), 1), API_MAX_LIMIT)
+            sort = request.args.get('sort', '')
+            direction = request.args.get('dir', '')
+            search = request.args.get('search', '').strip().lower()
+            passwords = self._passwords_with_info()
+            if search:
+                passwords = [p for p in passwords if search in p['ssid'].lower() or search in p['bssid'].lower()]
+            if sort not in SORT_KEYS or sort not in self.fields:
+                if self.strength_display and any(p['rssi'] is not None for p in passwords):
+                    sort, direction = 'strength', 'desc'
+                else:
+                    sort, direction = 'ssid', 'asc'
+            if direction not in ('asc', 'desc'):
+                direction = 'asc'
+            passwords = self._sort_passwords(passwords, sort, direction)
+            return jsonify({
+                "total": len(passwords),
+                "offset": offset,
+                "limit": limit,
+                "sort": sort,
+                "dir": direction,
+                "rows": passwords[offset:offset + limit]
+            })
+        except Exception as e:
+            logging.error(f"[Sorted-Password-List] Error serving password api: {e}")
+            return json.dumps({"status": "error", "message": str(e)}), 500
+
     def on_ui_setup(self, ui):
         self.counter = 0
         if self.show_number:
@@ -484,8 +843,11 @@ class SortedPasswordList(plugins.Plugin):
     def on_ui_update(self, ui):
         if self.counter >= 3:
             if self.show_number:
-                passwords = self._load_passwords()
-                self.count = len(passwords)
+                try:
+                    self.potfiles.refresh()
+                except Exception as err:
+                    logging.exception(f"[Sorted-Password-List] error while loading passwords: {repr(err)}")
+                self.count = len(self.potfiles)
                 ui.set("passwords", str(self.count))
             self.counter = 0
         self.counter += 1
@@ -1,6 +1,22 @@
-import logging, os, glob, pwnagotchi
+# keep per download type zip archives on disk, a download then only compresses new and changed captures
+# main.plugins.uncracked.prebuilt_archives = false
+# main.plugins.uncracked.archive_dir = "/root/.uncracked"
+# convert pcaps without a .22000 file for the 22000 download, using this many worker processes
+# main.plugins.uncracked.convert_pcaps = true
+# main.plugins.uncracked.convert_workers = 2
+# upload new uncracked 22000 hashes in batches to a wpa-sec style cracking service
+# main.plugins.uncracked.upload_url = "http://192.168.1.10:8080/"
+# main.plugins.uncracked.upload_key = "api_key"
+# main.plugins.uncracked.results_url = "http://192.168.1.10:8080/?api&dl=1"
+# main.plugins.uncracked.upload_batch_size = 500
+# main.plugins.uncracked.upload_interval = 300
+import logging, os, io, re, json, queue, struct, time, threading, multiprocessing, hashlib, mimetypes, unicodedata, requests, pwnagotchi
 import pwnagotchi.plugins as plugins
-from flask import abort, send_from_directory, render_template_string, make_response, send_file
+from flask import abort, render_template_string, Response, jsonify
+from requests.adapters import HTTPAdapter
+from urllib.parse import quote
+from werkzeug.exceptions import HTTPException
+from werkzeug.wsgi import wrap_file
 import zipfile
 
 TEMPLATE = """
@@ -69,6 +85,12 @@ TEMPLATE = """
     function downloadHandshakes16800() {
         window.location.href = "/plugins/uncracked/download_16800";
     }
+    function downloadHashlist22000() {
+        window.location.href = "/plugins/uncracked/download_hashlist_22000";
+    }
+    function downloadHashlist16800() {
+        window.location.href = "/plugins/uncracked/download_hashlist_16800";
+    }
 {% endblock %}
 {% block content %}
     <div class="button-container">
@@ -76,25 +98,866 @@ TEMPLATE = """
         <button id="download-btn" onclick="downloadHandshakes22000()">Download Uncracked 22000 Handshakes</button>
         <button id="download-btn" onclick="downloadHandshakespcap()">Download Uncracked pcap Handshakes</button>
         <button id="download-btn" onclick="downloadHandshakes16800()">Download Uncracked 16800 Handshakes</button>
+        <button id="download-btn" onclick="downloadHashlist22000()">Download Combined 22000 Hashlist</button>
+        <button id="download-btn" onclick="downloadHashlist16800()">Download Combined 16800 Hashlist</button>
     </div>
     <input type="text" id="filter" placeholder="Search for ..." title="Type in a filter">
     <ul id="list" data-role="listview" style="list-style-type:disc;">
         {% for handshake in handshakes %}
-            {% for ext in handshake.ext %}
-                <li class="file">
-                    <a href="/plugins/uncracked/{{handshake.name}}{{ext}}">{{handshake.name}}{{ext}}</a>
-                </li>
-            {% endfor %}
+            <li class="file">
+                {{handshake.name}}
+                {% for ext in handshake.ext %}
+                    <a href="/plugins/uncracked/{{handshake.name}}{{ext}}">{{ext}}</a>
+                {% endfor %}
+                ({{handshake.size|filesizeformat}}, {{handshake.modified}})
+            </li>
         {% endfor %}
     </ul>
 {% endblock %}
 """
 
+CAPTURE_NAME = re.compile(r'^(.*)_([0-9a-fA-F]{12})(?![0-9a-fA-F])')
+
+
+def normalize_key(ssid, bssid):
+    return re.sub(r'[^a-zA-Z0-9]', '', ssid), bssid.replace(':', '').lower()
+
+
+def capture_key(name):
+    match = CAPTURE_NAME.match(name)
+    if match is None:
+        return None
+    return normalize_key(match.group(1), match.group(2))
+
+
+class PotfileKeys:
+    # normalized (ssid, bssid) keys of the cracked potfile, reparsed only when the file changes
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._signature = None
+        self._keys = set()
+
+    def keys(self):
+        with self._lock:
+            try:
+                st = os.stat(self.path)
+                signature = (st.st_ino, st.st_size, st.st_mtime_ns)
+            except FileNotFoundError:
+                if self._signature is not False:
+                    logging.error("[Uncracked] potfile not found")
+                self._signature = False
+                self._keys = set()
+                return self._keys
+            if signature != self._signature:
+                self._keys = self._parse()
+                self._signature = signature
+            return self._keys
+
+    def _parse(self):
+        keys = set()
+        try:
+            with open(self.path, 'r') as file_in:
+                for line in file_in:
+                    fields = line.strip().split(":")
+                    if len(fields) >= 3:
+                        keys.add(normalize_key(fields[2], fields[0]))
+        except Exception as e:
+            logging.error(f"[Uncracked] error reading potfile: {e}")
+        return keys
+
+
+# pcaps compress well, the text hash files are tiny so deflating them only costs cpu
+ZIP_COMPRESSION = {
+    'pcap': zipfile.ZIP_DEFLATED,
+    '2500': zipfile.ZIP_DEFLATED,
+    '22000': zipfile.ZIP_STORED,
+    '16800': zipfile.ZIP_STORED,
+}
+ZIP_CHUNK_SIZE = 64 * 1024
+
+
+class ZipStream(io.RawIOBase):
+    # unseekable sink for zipfile, the bytes written so far are handed out with pop()
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def pop(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def write_zip_entry(zipf, file_path, arcname, comment=b''):
+    zinfo = zipfile.ZipInfo.from_file(file_path, arcname)
+    zinfo.compress_type = ZIP_COMPRESSION.get(file_path.rsplit('.', 1)[-1], zipfile.ZIP_DEFLATED)
+    zinfo.comment = comment
+    with open(file_path, 'rb') as src, zipf.open(zinfo, 'w') as dest:
+        while True:
+            chunk = src.read(ZIP_CHUNK_SIZE)
+            if not chunk:
+                break
+            dest.write(chunk)
+            yield
+
+
+def copy_zip_entry(source, info, zipf):
+    # copies an entry of source into zipf without decompressing and compressing it again. zipfile
+    # has no api for this, so the local record is copied as is and registered in zipf by hand.
+    # entries followed by a data descriptor are left to the caller, returns whether it was copied.
+    if info.flag_bits & 0x08:
+        return False
+    source.fp.seek(info.header_offset)
+    header = source.fp.read(30)
+    if len(header) != 30 or header[:4] != b'PK\x03\x04':
+        raise zipfile.BadZipFile(f"bad local header for {info.filename}")
+    name_len, extra_len = struct.unpack_from('<HH', header, 26)
+    remaining = name_len + extra_len + info.compress_size
+    info.header_offset = zipf.fp.tell()
+    zipf.fp.write(header)
+    while remaining:
+        chunk = source.fp.read(min(ZIP_CHUNK_SIZE, remaining))
+        if not chunk:
+            raise zipfile.BadZipFile(f"truncated entry {info.filename}")
+        zipf.fp.write(chunk)
+        remaining -= len(chunk)
+    zipf.filelist.append(info)
+    zipf.NameToInfo[info.filename] = info
+    zipf.start_dir = zipf.fp.tell()
+    zipf._didModify = True
+    return True
+
+
+def stream_zip(files):
+    sink = ZipStream()
+    with zipfile.ZipFile(sink, 'w') as zipf:
+        for file_path, arcname in files:
+            try:
+                for _ in write_zip_entry(zipf, file_path, arcname):
+                    data = sink.pop()
+                    if data:
+                        yield data
+            except FileNotFoundError:
+                continue
+            logging.debug(f"[Uncracked] Added file to zip archive: {file_path}")
+            data = sink.pop()
+            if data:
+                yield data
+    yield sink.pop()
+
+
+def set_attachment(response, filename):
+    # Content-Disposition the way werkzeug's send_file builds it: a quoted filename, plus an RFC 5987
+    # filename* with the utf-8 name and an ascii only fallback when the name is not plain ascii
+    try:
+        filename.encode('ascii')
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize('NFKD', filename).encode('ascii', 'ignore').decode('ascii')
+        names = {'filename': simple, 'filename*': f"UTF-8''{quote(filename, safe='!#$&+^`|~')}"}
+    else:
+        names = {'filename': filename}
+    response.headers.set('Content-Disposition', 'attachment', **names)
+
+
+def conditional_file_response(request, file_path, etag=None):
+    # sends a file with validators and byte range support so interrupted downloads can resume.
+    # without an explicit etag the inode, size and mtime of the opened file are used.
+    file_in = open(file_path, 'rb')
+    try:
+        st = os.fstat(file_in.fileno())
+        if etag is None:
+            etag = f"{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}"
+        mimetype = mimetypes.guess_type(file_path)[0] or 'application/octet-stream'
+        response = Response(wrap_file(request.environ, file_in), mimetype=mimetype, direct_passthrough=True)
+    except Exception:
+        file_in.close()
+        raise
+    response.content_length = st.st_size
+    response.last_modified = int(st.st_mtime)
+    response.set_etag(etag)
+    set_attachment(response, os.path.basename(file_path))
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request, accept_ranges=True, complete_length=st.st_size)
+
+
+HASHLIST_SEEN_LIMIT = 250000
+
+
+def hash_line_key(line):
+    # (ssid, bssid) key of a 22000 (WPA*0x*hash*ap*sta*essid*...) or 16800 (pmkid*ap*sta*essid) line
+    fields = line.split('*')
+    if fields[0] == 'WPA':
+        fields = fields[2:]
+    if len(fields) < 4:
+        return None
+    try:
+        essid = bytes.fromhex(fields[3]).decode('utf-8', errors='replace')
+    except ValueError:
+        return None
+    return normalize_key(essid, fields[1])
+
+
+def stream_hashlist(paths, unique_lines, seen_limit=HASHLIST_SEEN_LIMIT):
+    # one combined hashlist, duplicate lines are dropped using 64 bit digests. once seen_limit
+    # digests are held new lines are still sent but no longer remembered, keeping memory bounded.
+    seen = set()
+    chunk = []
+    chunk_size = 0
+    for path in paths:
+        try:
+            with open(path, 'r', errors='replace') as file_in:
+                for line in file_in:
+                    line = line.strip()
+                    if not line or hash_line_key(line) in unique_lines:
+                        continue
+                    digest = int.from_bytes(hashlib.blake2b(line.encode(), digest_size=8).digest(), 'big')
+                    if digest in seen:
+                        continue
+                    if len(seen) < seen_limit:
+                        seen.add(digest)
+                    chunk.append(line)
+                    chunk_size += len(line) + 1
+                    if chunk_size >= ZIP_CHUNK_SIZE:
+                        yield '\n'.join(chunk) + '\n'
+                        chunk = []
+                        chunk_size = 0
+        except FileNotFoundError:
+            continue
+    if chunk:
+        yield '\n'.join(chunk) + '\n'
+
+
+class UncrackedArchive:
+    # zip archive on disk that is brought up to date when it is downloaded. every entry carries the
+    # size and mtime of its source file in the entry comment, entries whose file is unchanged are
+    # copied over still compressed and only new and changed captures are read and compressed.
+    def __init__(self, path, extensions):
+        self.path = path
+        self.extensions = extensions
+        self._lock = threading.Lock()
+        self._entries = None
+
+    def sync(self, files):
+        with self._lock:
+            self._ensure_loaded()
+            if not os.path.exists(self.path):
+                self._entries = {}
+            kept = {name for name, signature in self._entries.items()
+                    if name in files and files[name][1:] == signature}
+            if len(kept) != len(files) or len(kept) != len(self._entries) or not os.path.exists(self.path):
+                logging.info(f"[Uncracked] updating {self.path}, {len(files) - len(kept)} entries added "
+                             f"or replaced, {len(self._entries.keys() - files.keys())} dropped")
+                self._update(files, kept)
+            return self.path
+
+    def _update(self, files, kept):
+        # the archive is written beside the old one and swapped in, so downloads still streaming
+        # the old archive keep reading a complete file
+        tmp_path = f"{self.path}.tmp"
+        entries = self._entries
+        fresh = {name: info for name, info in files.items() if name not in kept}
+        self._entries = {}
+        try:
+            with zipfile.ZipFile(tmp_path, 'w') as zipf:
+                if kept:
+                    with zipfile.ZipFile(self.path) as old:
+                        for info in sorted((old.getinfo(name) for name in kept), key=lambda x: x.header_offset):
+                            if copy_zip_entry(old, info, zipf):
+                                self._entries[info.filename] = entries[info.filename]
+                            else:
+                                fresh[info.filename] = files[info.filename]
+                self._write(zipf, fresh)
+            os.replace(tmp_path, self.path)
+        except Exception:
+            self._entries = None
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _ensure_loaded(self):
+        if self._entries is not None:
+            return
+        self._entries = {}
+        try:
+            with zipfile.ZipFile(self.path) as zipf:
+                for info in zipf.infolist():
+                    self._entries[info.filename] = (info.file_size, int(info.comment or b'0'))
+        except FileNotFoundError:
+            pass
+        except (zipfile.BadZipFile, ValueError) as e:
+            logging.error(f"[Uncracked] discarding broken archive {self.path}: {e}")
+            os.remove(self.path)
+            self._entries = {}
+
+    def _write(self, zipf, files):
+        for arcname, (file_path, size, mtime_ns) in files.items():
+            try:
+                for _ in write_zip_entry(zipf, file_path, arcname, str(mtime_ns).encode()):
+                    pass
+            except FileNotFoundError:
+                continue
+            self._entries[arcname] = (size, mtime_ns)
+            logging.debug(f"[Uncracked] Added file to zip archive: {file_path}")
+
+
+CONVERT_INTERVAL = 600
+
+
+# --- shared capture reader --------------------------------------------------------------------
+# plugins are single files, so this block is carried by both aircrackonly.py and uncracked.py.
+# aircrackonly.py holds the canonical copy: change it there and copy the block over byte for byte.
+PCAPNG_SHB = 0x0A0D0D0A
+LLC_EAPOL = b'\xaa\xaa\x03\x00\x00\x00\x88\x8e'
+PMKID_KDE = b'\xdd\x14\x00\x0f\xac\x04'
+FORK_POLL = 5
+FORK_WORKER_DIED = 'worker died'
+
+
+def iter_frames(view):
+    # yields (linktype, frame) slices of a classic pcap or pcapng capture held in bytes or a memoryview
+    if len(view) >= 12 and struct.unpack_from('<I', view, 0)[0] == PCAPNG_SHB:
+        yield from _iter_pcapng_frames(view)
+        return
+    if len(view) < 24:
+        return
+    magic = struct.unpack_from('<I', view, 0)[0]
+    if magic in (0xa1b2c3d4, 0xa1b23c4d):
+        endian = '<'
+    elif magic in (0xd4c3b2a1, 0x4d3cb2a1):
+        endian = '>'
+    else:
+        return
+    linktype = struct.unpack_from(endian + 'I', view, 20)[0] & 0x0fffffff
+    offset = 24
+    while offset + 16 <= len(view):
+        incl_len = struct.unpack_from(endian + 'I', view, offset + 8)[0]
+        start = offset + 16
+        if start + incl_len > len(view):
+            break
+        yield linktype, view[start:start + incl_len]
+        offset = start + incl_len
+
+
+def _iter_pcapng_frames(view):
+    endian = '<'
+    linktypes = []
+    offset = 0
+    while offset + 12 <= len(view):
+        block_type = struct.unpack_from(endian + 'I', view, offset)[0]
+        if block_type == PCAPNG_SHB:
+            endian = '<' if bytes(view[offset + 8:offset + 12]) == b'\x4d\x3c\x2b\x1a' else '>'
+            linktypes = []
+        block_len = struct.unpack_from(endian + 'I', view, offset + 4)[0]
+        if block_len < 12 or offset + block_len > len(view):
+            break
+        if block_type == 1:
+            linktypes.append(struct.unpack_from(endian + 'H', view, offset + 8)[0])
+        elif block_type == 6 and block_len >= 32:
+            interface, = struct.unpack_from(endian + 'I', view, offset + 8)
+            caplen, = struct.unpack_from(endian + 'I', view, offset + 20)
+            if interface < len(linktypes):
+                yield linktypes[interface], view[offset + 28:offset + 28 + min(caplen, block_len - 32)]
+        elif block_type == 3 and linktypes:
+            origlen, = struct.unpack_from(endian + 'I', view, offset + 8)
+            yield linktypes[0], view[offset + 12:offset + 12 + min(origlen, block_len - 16)]
+        offset += block_len
+
+
+def dot11_frame(linktype, frame):
+    # strips radiotap / ppi / prism / avs headers, None for link types without 802.11 frames
+    if linktype in (127, 192):
+        if len(frame) < 4:
+            return None
+        return frame[struct.unpack_from('<H', frame, 2)[0]:]
+    if linktype == 105:
+        return frame
+    if linktype in (119, 163):
+        if len(frame) < 8:
+            return None
+        # some drivers put an avs header behind the prism link type, it starts with its version
+        if linktype == 163 or struct.unpack_from('>I', frame, 0)[0] & 0xfffffff0 == 0x80211000:
+            header_len, = struct.unpack_from('>I', frame, 4)
+        else:
+            # prism msglen is in host byte order
+            header_len, = struct.unpack_from('<I', frame, 4)
+            if header_len > len(frame):
+                header_len, = struct.unpack_from('>I', frame, 4)
+        if header_len > len(frame):
+            return None
+        return frame[header_len:]
+    return None
+
+
+def eapol_key(frame):
+    # (ap, station, key_info, replay_counter, nonce, eapol) of an unprotected EAPOL-Key data frame,
+    # eapol is cut to the length its header declares
+    flags = frame[1]
+    if (frame[0] >> 2) & 0x03 != 2 or flags & 0x40:
+        return None
+    header_len = 24
+    if flags & 0x03 == 0x03:
+        header_len += 6
+    if frame[0] & 0x80:
+        header_len += 2
+        if flags & 0x80:
+            header_len += 4
+    if bytes(frame[header_len:header_len + 8]) != LLC_EAPOL:
+        return None
+    eapol = frame[header_len + 8:]
+    if len(eapol) < 99 or eapol[1] != 3:
+        return None
+    eapol = eapol[:4 + struct.unpack_from('>H', eapol, 2)[0]]
+    if len(eapol) < 99:
+        return None
+    if flags & 0x03 == 0x02:
+        ap, station = bytes(frame[10:16]), bytes(frame[4:10])
+    elif flags & 0x03 == 0x01:
+        ap, station = bytes(frame[4:10]), bytes(frame[10:16])
+    else:
+        return None
+    key_info, = struct.unpack_from('>H', eapol, 5)
+    replay, = struct.unpack_from('>Q', eapol, 9)
+    return ap, station, key_info, replay, bytes(eapol[17:49]), eapol
+
+
+def eapol_message(key_info, nonce):
+    # 1-4 for the message of the 4-way handshake a pairwise EAPOL-Key frame is, None otherwise
+    if not key_info & 0x0008:
+        return None
+    ack, mic, install, secure = key_info & 0x0080, key_info & 0x0100, key_info & 0x0040, key_info & 0x0200
+    if ack and not mic:
+        return 1
+    if ack and mic and install:
+        return 3
+    if mic and not ack and not secure and nonce.strip(b'\x00'):
+        return 2
+    if mic and not ack:
+        return 4
+    return None
+
+
+def eapol_pmkid(eapol):
+    # the PMKID in the key data of an M1, None when it carries none
+    key_data = bytes(eapol[99:99 + struct.unpack_from('>H', eapol, 97)[0]])
+    pos = key_data.find(PMKID_KDE)
+    if pos < 0:
+        return None
+    pmkid = key_data[pos + 6:pos + 22]
+    if len(pmkid) != 16 or not pmkid.strip(b'\x00'):
+        return None
+    return pmkid
+
+
+def _fork_worker(function, tasks, results):
+    for item in iter(tasks.get, None):
+        try:
+            results.put((item, function(item), None))
+        except Exception as e:
+            results.put((item, None, str(e) or type(e).__name__))
+
+
+def fork_map(function, items, workers):
+    # yields (item, result, error) for every item. plugins are loaded without a module name, so
+    # function can not be pickled for a process pool; forked workers already have it. error is
+    # None, the exception text, or FORK_WORKER_DIED for the items left once every worker is gone
+    # (a worker killed mid item, e.g. by the oom killer, never answers)
+    workers = min(workers, len(items))
+    if workers <= 1:
+        for item in items:
+            try:
+                yield item, function(item), None
+            except Exception as e:
+                yield item, None, str(e) or type(e).__name__
+        return
+    context = multiprocessing.get_context('fork')
+    tasks, results = context.Queue(), context.Queue()
+    processes = [context.Process(target=_fork_worker, args=(function, tasks, results), daemon=True)
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+    try:
+        for item in items:
+            tasks.put(item)
+        for _ in processes:
+            tasks.put(None)
+        pending = set(items)
+        while pending:
+            try:
+                item, result, error = results.get(timeout=FORK_POLL)
+            except queue.Empty:
+                if not any(process.is_alive() for process in processes):
+                    break
+                continue
+            pending.discard(item)
+            yield item, result, error
+        for item in pending:
+            yield item, None, FORK_WORKER_DIED
+    finally:
+        for process in processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+# --- end of shared capture reader -------------------------------------------------------------
+
+
+def _essid_from_ies(ies):
+    offset = 0
+    while offset + 2 <= len(ies):
+        tag, length = ies[offset], ies[offset + 1]
+        if tag == 0:
+            essid = bytes(ies[offset + 2:offset + 2 + length])
+            if 0 < len(essid) <= 32 and essid.strip(b'\x00'):
+                return essid
+            return None
+        offset += 2 + length
+    return None
+
+
+def pcap_to_22000(path):
+    # pure python equivalent of hcxpcapngtool -o for the frames pwnagotchi captures:
+    # PMKIDs from M1 and M1+M2 / M2+M3 EAPOL pairs, as hashcat 22000 lines
+    with open(path, 'rb') as file_in:
+        data = file_in.read()
+    essids = {}
+    anonces = {}
+    pmkids = {}
+    m2s = {}
+    for linktype, frame in iter_frames(data):
+        frame = dot11_frame(linktype, frame)
+        if frame is None or len(frame) < 24:
+            continue
+        frame_type = (frame[0] >> 2) & 0x03
+        subtype = frame[0] >> 4
+        flags = frame[1]
+        if frame_type == 0:
+            body_offsets = {8: 36, 5: 36, 0: 28, 2: 34}
+            if subtype in body_offsets:
+                essid = _essid_from_ies(frame[body_offsets[subtype]:])
+                if essid:
+                    essids.setdefault(bytes(frame[16:22]), essid)
+            continue
+        key = eapol_key(frame)
+        if key is None:
+            continue
+        ap, sta, key_info, replay, nonce, eapol = key
+        if key_info & 0x0007 not in (1, 2, 3):
+            continue
+        message = eapol_message(key_info, nonce)
+        if message == 1:
+            anonces.setdefault((ap, sta), {}).setdefault(('m1', replay), nonce)
+            pmkid = eapol_pmkid(eapol)
+            if pmkid is not None:
+                pmkids.setdefault((ap, sta), pmkid)
+        elif message == 3:
+            anonces.setdefault((ap, sta), {}).setdefault(('m3', replay), nonce)
+        elif message == 2:
+            zeroed = eapol[:81] + b'\x00' * 16 + eapol[97:]
+            m2s.setdefault((ap, sta, eapol[81:97]), (replay, zeroed))
+    lines = []
+    for (ap, sta), pmkid in pmkids.items():
+        essid = essids.get(ap)
+        if essid:
+            lines.append(f"WPA*01*{pmkid.hex()}*{ap.hex()}*{sta.hex()}*{essid.hex()}***")
+    for (ap, sta, mic), (replay, zeroed) in m2s.items():
+        essid = essids.get(ap)
+        nonces = anonces.get((ap, sta), {})
+        if not essid or not nonces:
+            continue
+        if ('m1', replay) in nonces:
+            anonce, message_pair = nonces[('m1', replay)], 0x00
+        elif ('m3', replay + 1) in nonces:
+            anonce, message_pair = nonces[('m3', replay + 1)], 0x02
+        else:
+            # replay counters did not line up, let hashcat know it has to try nonce corrections
+            (kind, _), anonce = next(iter(nonces.items()))
+            message_pair = 0x80 if kind == 'm1' else 0x82
+        lines.append(f"WPA*02*{mic.hex()}*{ap.hex()}*{sta.hex()}*{essid.hex()}*{anonce.hex()}*{zeroed.hex()}*{message_pair:02x}")
+    return lines
+
+
+class PcapConverter:
+    # hashcat 22000 files generated from pcaps that have none, kept in output_dir together with an
+    # index keyed by the pcap's size and mtime so every capture is converted only once.
+    # conversions run in forked worker processes since plugins are not importable by name, from
+    # the plugin's converter thread only. readers just get what is already converted.
+    def __init__(self, output_dir, workers=None):
+        self.output_dir = output_dir
+        self.workers = workers or os.cpu_count() or 1
+        self.index_path = os.path.join(output_dir, 'index.json')
+        self._lock = threading.Lock()
+        self._convert_lock = threading.Lock()
+        os.makedirs(output_dir, exist_ok=True)
+        try:
+            with open(self.index_path, 'r') as index_file:
+                self._index = json.load(index_file)
+        except (FileNotFoundError, ValueError):
+            self._index = {}
+
+    def convert(self, pcaps):
+        # pcaps maps arcname to (path, size, mtime_ns), converts the ones not converted yet and
+        # returns converted() for them. the index lock is only held to read and store results.
+        with self._convert_lock:
+            with self._lock:
+                pending = {info[0]: name for name, info in pcaps.items()
+                           if self._index.get(name, [None, None])[:2] != [info[1], info[2]]}
+            if pending:
+                logging.info(f"[Uncracked] converting {len(pending)} pcaps to 22000")
+                for path, lines in self._convert(list(pending)):
+                    name = pending[path]
+                    _, size, mtime_ns = pcaps[name]
+                    output_path = self._output_path(name)
+                    if lines:
+                        with open(f"{output_path}.tmp", 'w') as output_file:
+                            output_file.write('\n'.join(lines) + '\n')
+                        os.replace(f"{output_path}.tmp", output_path)
+                    elif os.path.exists(output_path):
+                        os.remove(output_path)
+                    if lines is not None:
+                        with self._lock:
+                            self._index[name] = [size, mtime_ns, len(lines)]
+                with self._lock:
+                    with open(f"{self.index_path}.tmp", 'w') as index_file:
+                        json.dump(self._index, index_file)
+                    os.replace(f"{self.index_path}.tmp", self.index_path)
+        return self.converted(pcaps)
+
+    def converted(self, pcaps):
+        # arcname of the 22000 file to its info, for the pcaps that are already converted
+        converted = {}
+        with self._lock:
+            names = [name for name, info in pcaps.items()
+                     if self._index.get(name, [None, None, 0])[:2] == [info[1], info[2]] and self._index[name][2]]
+        for name in names:
+            output_path = self._output_path(name)
+            try:
+                st = os.stat(output_path)
+            except FileNotFoundError:
+                continue
+            converted[f"{name[:-len('.pcap')]}.22000"] = (output_path, st.st_size, st.st_mtime_ns)
+        return converted
+
+    def _output_path(self, name):
+        return os.path.join(self.output_dir, f"{name[:-len('.pcap')].replace(os.sep, '_')}.22000")
+
+    def _convert(self, paths):
+        for path, lines, error in fork_map(pcap_to_22000, paths, self.workers):
+            if error == FORK_WORKER_DIED:
+                # recorded as converted to nothing so it is not retried until the capture changes
+                logging.error(f"[Uncracked] conversion worker died before converting {path}")
+                yield path, []
+            elif error is not None:
+                logging.error(f"[Uncracked] error converting {path}: {error}")
+                yield path, None
+            else:
+                yield path, lines
+
+
+RESULT_LINE = re.compile(r'^[0-9a-fA-F]{12}:[^:]*:[^:]*:.+$')
+
+
+class HashUploader:
+    # sends uncracked 22000 lines in batches to a wpa-sec style cracking service. pending lines live
+    # in a queue file and the digests of accepted lines in a sent file, so an interrupted run picks
+    # up where it stopped and nothing is uploaded twice.
+    def __init__(self, state_dir, url, key=None, results_url=None, batch_size=500, timeout=60):
+        self.url = url
+        self.key = key
+        self.results_url = results_url
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.queue_path = os.path.join(state_dir, 'upload_queue.22000')
+        self.sent_path = os.path.join(state_dir, 'uploaded.digests')
+        self.session = requests.Session()
+        self.session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=2, max_retries=2))
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=2, max_retries=2))
+        if key:
+            self.session.cookies.set('key', key)
+        self._lock = threading.Lock()
+        self.stats = {'uploads': 0, 'failures': 0, 'lines': 0, 'bytes': 0, 'seconds': 0.0,
+                      'last_latency': None, 'last_throughput': None, 'results': 0}
+        os.makedirs(state_dir, exist_ok=True)
+        self._sent = set()
+        try:
+            with open(self.sent_path, 'r') as sent_file:
+                self._sent = {int(line, 16) for line in sent_file if line.strip()}
+        except FileNotFoundError:
+            pass
+        self._queued = set()
+        try:
+            with open(self.queue_path, 'r') as queue_file:
+                self._queued = {self._digest(line.strip()) for line in queue_file if line.strip()}
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def _digest(line):
+        return int.from_bytes(hashlib.blake2b(line.encode(), digest_size=8).digest(), 'big')
+
+    def enqueue(self, lines):
+        with self._lock:
+            added = 0
+            with open(self.queue_path, 'a') as queue_file:
+                for line in lines:
+                    digest = self._digest(line)
+                    if digest in self._sent or digest in self._queued:
+                        continue
+                    queue_file.write(line + '\n')
+                    self._queued.add(digest)
+                    added += 1
+            return added
+
+    def flush(self):
+        # uploads batches until the queue is empty, stops at the first failure and keeps the rest
+        with self._lock:
+            try:
+                with open(self.queue_path, 'r') as queue_file:
+                    pending = [line.strip() for line in queue_file if line.strip()]
+            except FileNotFoundError:
+                return
+            while pending:
+                batch = pending[:self.batch_size]
+                if not self._upload(batch):
+                    break
+                with open(self.sent_path, 'a') as sent_file:
+                    for line in batch:
+                        digest = self._digest(line)
+                        sent_file.write(f"{digest:016x}\n")
+                        self._sent.add(digest)
+                        self._queued.discard(digest)
+                pending = pending[len(batch):]
+                with open(f"{self.queue_path}.tmp", 'w') as queue_file:
+                    queue_file.writelines(line + '\n' for line in pending)
+                os.replace(f"{self.queue_path}.tmp", self.queue_path)
+
+    def _upload(self, batch):
+        body = ('\n'.join(batch) + '\n').encode()
+        start = time.monotonic()
+        try:
+            response = self.session.post(self.url, files={'file': ('uncracked.22000', body)}, timeout=self.timeout)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            self.stats['failures'] += 1
+            logging.error(f"[Uncracked] upload of {len(batch)} hashes failed: {e}")
+            return False
+        elapsed = time.monotonic() - start
+        self.stats['uploads'] += 1
+        self.stats['lines'] += len(batch)
+        self.stats['bytes'] += len(body)
+        self.stats['seconds'] += elapsed
+        self.stats['last_latency'] = elapsed
+        self.stats['last_throughput'] = len(body) / elapsed if elapsed else None
+        logging.info(f"[Uncracked] uploaded {len(batch)} hashes ({len(body)} bytes) in {elapsed:.2f}s")
+        return True
+
+    def fetch_results(self, potfile_path):
+        # appends bssid:station:ssid:password lines of the service's potfile that are not in ours yet,
+        # anything else (error pages, html, truncated lines) is left out
+        if not self.results_url:
+            return 0
+        try:
+            response = self.session.get(self.results_url, timeout=self.timeout)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            logging.error(f"[Uncracked] fetching results failed: {e}")
+            return 0
+        try:
+            with open(potfile_path, 'r') as file_in:
+                known = {line.strip() for line in file_in}
+        except FileNotFoundError:
+            known = set()
+        new_lines = []
+        rejected = 0
+        for line in response.text.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            if not RESULT_LINE.match(line):
+                rejected += 1
+            elif line not in known:
+                known.add(line)
+                new_lines.append(line)
+        if rejected:
+            logging.warning(f"[Uncracked] rejected {rejected} malformed lines from {self.results_url}")
+        if new_lines:
+            with open(potfile_path, 'a') as file_out:
+                file_out.writelines(line + '\n' for line in new_lines)
+            self.stats['results'] += len(new_lines)
+            logging.info(f"[Uncracked] added {len(new_lines)} cracked results to {potfile_path}")
+        return len(new_lines)
+
+    def snapshot(self):
+        stats = dict(self.stats)
+        stats['queued'] = len(self._queued)
+        stats['sent'] = len(self._sent)
+        stats['average_throughput'] = stats['bytes'] / stats['seconds'] if stats['seconds'] else None
+        return stats
+
+
 class Handshake:
-    def __init__(self, name, path, ext):
+    def __init__(self, name, path, ext, size=0, mtime=0):
         self.name = name
         self.path = path
         self.ext = ext
+        self.size = size
+        self.mtime = mtime
+
+    @property
+    def modified(self):
+        return time.strftime('%Y-%m-%d %H:%M', time.localtime(self.mtime))
+
+
+class HandshakeCatalog:
+    # all captures in the handshakes directory grouped by name, built with a single scandir.
+    # the catalog is rebuilt when the directory mtime changes or invalidate() is called
+    # from on_handshake, since bettercap appends to existing pcaps without touching the directory.
+    EXTENSIONS = ('.pcap', '.2500', '.16800', '.22000')
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._signature = None
+        self._handshakes = []
+
+    def invalidate(self):
+        with self._lock:
+            self._signature = None
+
+    def handshakes(self):
+        with self._lock:
+            signature = os.stat(self.directory).st_mtime_ns
+            if signature != self._signature:
+                self._handshakes = self._scan()
+                self._signature = signature
+            return self._handshakes
+
+    def _scan(self):
+        grouped = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                ext = next((ext for ext in self.EXTENSIONS if entry.name.endswith(ext)), None)
+                if ext is None or not entry.is_file():
+                    continue
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                name = entry.name[:-len(ext)]
+                handshake = grouped.get(name)
+                if handshake is None:
+                    handshake = grouped[name] = Handshake(name, entry.path[:-len(ext)], [])
+                handshake.ext.append(ext)
+                handshake.size += st.st_size
+                handshake.mtime = max(handshake.mtime, st.st_mtime)
+        for handshake in grouped.values():
+            handshake.ext.sort(key=self.EXTENSIONS.index)
+        return sorted(grouped.values(), key=lambda x: x.name.lower())
 
 class Uncracked(plugins.Plugin):
     __author__ = 'NeonLightning'
@@ -102,68 +965,161 @@ class Uncracked(plugins.Plugin):
     __license__ = 'GPL3'
     __description__ = 'Download handshake not found in wpa-sec from web-ui.'
 
+    ARCHIVES = {
+        None: ['pcap', '22000', '16800'],
+        '22000': ['22000'],
+        'pcap': ['pcap'],
+        '16800': ['16800'],
+    }
+
     def __init__(self):
         self.ready = False
+        self.cracked = None
+        self.archives = {}
+        self.catalog = None
+        self.converter = None
+        self.uploader = None
+        self.digests = {}
+        self.stop_event = threading.Event()
+        self.convert_event = threading.Event()
 
     def on_loaded(self):
+        self.prebuilt_archives = self.options.get('prebuilt_archives', False)
+        self.archive_dir = self.options.get('archive_dir', '/root/.uncracked')
+        if self.prebuilt_archives:
+            os.makedirs(self.archive_dir, exist_ok=True)
+            for extension, extensions in self.ARCHIVES.items():
+                zip_suffix = f"_{extension}" if extension else ""
+                self.archives[extension] = UncrackedArchive(os.path.join(self.archive_dir, f"handshakes{zip_suffix}.zip"), extensions)
+        if self.options.get('convert_pcaps', True):
+            self.converter = PcapConverter(os.path.join(self.archive_dir, 'converted'), self.options.get('convert_workers'))
+        if self.options.get('upload_url'):
+            self.uploader = HashUploader(os.path.join(self.archive_dir, 'upload'), self.options['upload_url'],
+                                         key=self.options.get('upload_key'),
+                                         results_url=self.options.get('results_url'),
+                                         batch_size=self.options.get('upload_batch_size', 500))
         logging.info("[Uncracked] plugin loaded")
 
+    def on_unload(self, ui):
+        self.stop_event.set()
+        self.convert_event.set()
+        logging.info("[Uncracked] plugin unloaded")
+
     def on_config_changed(self, config):
         self.config = config
+        self.cracked = PotfileKeys(os.path.join(self.config['bettercap']['handshakes'], "wpa-sec.cracked.potfile"))
+        self.catalog = HandshakeCatalog(self.config['bettercap']['handshakes'])
+        if self.uploader and not self.ready:
+            threading.Thread(target=self.run_uploader, daemon=True).start()
+        if self.converter and not self.ready:
+            self.convert_event.set()
+            threading.Thread(target=self.run_converter, daemon=True).start()
         self.ready = True
 
+    def run_converter(self):
+        # conversions happen here only, downloads and the uploader use whatever is converted so far
+        while not self.stop_event.is_set():
+            self.convert_event.wait(CONVERT_INTERVAL)
+            self.convert_event.clear()
+            if self.stop_event.is_set():
+                break
+            try:
+                self.converter.convert(self.unconverted_pcaps())
+            except Exception as e:
+                logging.error(f"[Uncracked] error converting pcaps: {e}")
+
+    def run_uploader(self):
+        interval = self.options.get('upload_interval', 300)
+        while not self.stop_event.is_set():
+            try:
+                files = self.uncracked_files(['22000'])
+                paths = [file_path for file_path, _, _ in sorted(files.values())]
+                added = self.uploader.enqueue(line.rstrip('\n') for chunk in stream_hashlist(paths, self.read_potfile())
+                                              for line in chunk.splitlines())
+                if added:
+                    logging.info(f"[Uncracked] queued {added} new hashes for upload")
+                self.uploader.flush()
+                self.uploader.fetch_results(self.cracked.path)
+            except Exception as e:
+                logging.error(f"[Uncracked] error in uploader: {e}")
+            self.stop_event.wait(interval)
+
+    def on_handshake(self, agent, filename, access_point, client_station):
+        if not self.ready:
+            return
+        self.catalog.invalidate()
+        if self.converter and filename.endswith('.pcap'):
+            self.convert_event.set()
+
+    def uncracked_files(self, extensions):
+        convert = self.converter is not None and '22000' in extensions
+        files, pcaps = self._scan_uncracked(extensions, convert)
+        if convert:
+            for arcname, info in self.converter.converted(pcaps).items():
+                files.setdefault(arcname, info)
+        return files
+
+    def unconverted_pcaps(self):
+        return self._scan_uncracked([], True)[1]
+
+    def _scan_uncracked(self, extensions, convert):
+        # uncracked files with one of extensions, and with convert the pcaps that have no .22000 beside them
+        directory = self.config['bettercap']['handshakes']
+        unique_lines = self.read_potfile()
+        files = {}
+        pcaps = {}
+        for root, _, names in os.walk(directory):
+            for file in names:
+                file_extension = file.split('.')[-1]
+                if file_extension in extensions or (convert and file_extension == 'pcap'):
+                    file_path = os.path.join(root, file)
+                    ssid_bssid_ext = '.'.join(file.split('.')[:-1])
+                    if not self.is_in_potfile(ssid_bssid_ext, unique_lines):
+                        try:
+                            st = os.stat(file_path)
+                        except FileNotFoundError:
+                            continue
+                        arcname = os.path.relpath(file_path, directory)
+                        if file_extension in extensions:
+                            files[arcname] = (file_path, st.st_size, st.st_mtime_ns)
+                        if convert and file_extension == 'pcap':
+                            pcaps[arcname] = (file_path, st.st_size, st.st_mtime_ns)
+        if convert:
+            pcaps = {name: info for name, info in pcaps.items()
+                     if not os.path.exists(f"{info[0][:-len('.pcap')]}.22000")}
+        return files, pcaps
+
     def read_potfile(self):
-        potfile_path = os.path.join(self.config['bettercap']['handshakes'], "wpa-sec.cracked.potfile")
-        try:
-            with open(potfile_path, 'r') as file_in:
-                lines = file_in.readlines()
-            return set(tuple(line.split(":")[2:4]) for line in lines if line.strip())
-        except FileNotFoundError:
-            logging.error("[Uncracked] potfile not found")
-            return set()
-        except Exception as e:
-            logging.error(f"[Uncracked] error reading potfile: {e}")
-            return set()
+        return self.cracked.keys()
 
     def find_uncracked_handshakes(self, unique_lines):
         handshakes = []
         try:
-            for ext in ['.pcap', '.2500', '.16800', '.22000']:
-                pcapfiles = glob.glob(os.path.join(self.config['bettercap']['handshakes'], f"*{ext}"))
-                for path in pcapfiles:
-                    name = os.path.basename(path)[:-len(ext)]
-                    fullpathNoExt = path[:-len(ext)]
-                    if not any(f"{ssid}_{bssid}" in name for ssid, bssid in unique_lines):
-                        handshakes.append(Handshake(name, fullpathNoExt, [ext]))
-            handshakes = sorted(handshakes, key=lambda x: x.name.lower())
+            handshakes = [handshake for handshake in self.catalog.handshakes()
+                          if capture_key(handshake.name) not in unique_lines]
         except Exception as e:
             logging.error(f"[Uncracked] error finding uncracked handshakes: {e}")
         return handshakes
-    
-    def compress_and_send(self, extension=None):
+
+    def compress_and_send(self, extension=None, request=None):
         logging.info("[Uncracked] Compressing and sending")
         directory_to_compress = self.config['bettercap']['handshakes']
         logging.debug(f"[Uncracked] Compressing and sending {directory_to_compress}")
         zip_suffix = f"_{extension}" if extension else ""
-        zip_file_path = f"/tmp/handshakes{zip_suffix}.zip"
-        logging.info(f"[Uncracked] Compressing and sending {zip_file_path}")
+        zip_name = f"handshakes{zip_suffix}.zip"
+        logging.info(f"[Uncracked] Compressing and sending {zip_name}")
         default_extensions = ['pcap', '22000', '16800']
         extensions = extension.split(',') if extension else default_extensions
-        if os.path.exists(zip_file_path):
-            os.remove(zip_file_path)
         try:
-            with zipfile.ZipFile(zip_file_path, 'w') as zipf:
-                for root, _, files in os.walk(directory_to_compress):
-                    for file in files:
-                        file_extension = file.split('.')[-1]
-                        if file_extension in extensions:
-                            file_path = os.path.join(root, file)
-                            ssid_bssid_ext = '.'.join(file.split('.')[:-1])
-                            if not self.is_in_potfile(ssid_bssid_ext):
-                                zipf.write(file_path, os.path.relpath(file_path, directory_to_compress))
-                                logging.debug(f"[Uncracked] Added file to zip archive: {file_path}")
-            logging.debug(f"[Uncracked] Added files to zip archive")
-            response = make_response(send_file(zip_file_path, as_attachment=True))
+            files = self.uncracked_files(extensions)
+            archive = self.archives.get(extension)
+            if archive is not None:
+                return conditional_file_response(request, archive.sync(files))
+            else:
+                logging.debug(f"[Uncracked] Streaming {len(files)} files as zip archive")
+                response = Response(stream_zip((file_path, arcname) for arcname, (file_path, _, _) in files.items()),
+                                    mimetype='application/zip')
+                set_attachment(response, zip_name)
             response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, max-age=0'
             response.headers['Pragma'] = 'no-cache'
             response.headers['Expires'] = '0'
@@ -172,26 +1128,18 @@ class Uncracked(plugins.Plugin):
             logging.error(f"[Uncracked] Error compressing and sending file: {e}")
             abort(500)
 
+    def send_hashlist(self, extension):
+        files = self.uncracked_files([extension])
+        paths = [file_path for file_path, _, _ in sorted(files.values())]
+        response = Response(stream_hashlist(paths, self.read_potfile()), mimetype='text/plain')
+        set_attachment(response, f'uncracked.{extension}')
+        response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, max-age=0'
+        return response
 
-    def is_in_potfile(self, ssid_bssid_ext):
-        potfile_path = os.path.join(self.config['bettercap']['handshakes'], "wpa-sec.cracked.potfile")
-        try:
-            with open(potfile_path, 'r') as file_in:
-                lines = file_in.readlines()
-            lines = [line.strip() for line in lines if line.strip()]
-            for line in lines:
-                fields = line.split(":")
-                ssid = fields[2]
-                bssid = fields[0]
-                if f"{ssid}_{bssid}" in ssid_bssid_ext:
-                    return True
-            return False
-        except FileNotFoundError:
-            logging.error("[Uncracked] potfile not found")
-            return False
-        except Exception as e:
-            logging.error(f"[Uncracked] error reading potfile: {e}")
-            return False
+    def is_in_potfile(self, ssid_bssid_ext, unique_lines=None):
+        if unique_lines is None:
+            unique_lines = self.read_potfile()
+        return capture_key(ssid_bssid_ext) in unique_lines
 
     def on_webhook(self, path, request):
         try:
@@ -204,35 +1152,55 @@ class Uncracked(plugins.Plugin):
                 return render_template_string(TEMPLATE, title="Handshakes | " + pwnagotchi.name(), handshakes=data)
             elif path == "download":
                 logging.debug("[Uncracked] Compressing and sending on webhook")
-                return self.compress_and_send()
+                return self.compress_and_send(request=request)
             elif path == "download_22000":
                 logging.debug("[Uncracked] Compressing and sending 22000 on webhook")
-                return self.compress_and_send("22000")
+                return self.compress_and_send("22000", request=request)
+            elif path in ("download_hashlist_22000", "download_hashlist_16800"):
+                logging.debug(f"[Uncracked] Sending combined hashlist on webhook")
+                return self.send_hashlist(path.rsplit('_', 1)[-1])
+            elif path == "upload_stats":
+                return jsonify(self.uploader.snapshot() if self.uploader else {})
             elif path == "download_pcap":
                 logging.debug("[Uncracked] Compressing and sending pcap on webhook")
-                return self.compress_and_send("pcap")
+                return self.compress_and_send("pcap", request=request)
             elif path == "download_16800":
                 logging.debug("[Uncracked] Compressing and sending 16800 on webhook")
-                return self.compress_and_send("16800")
+                return self.compress_and_send("16800", request=request)
             else:
                 logging.info(f"[Uncracked] serving {path}")
-                return self.serve_file(path)
+                return self.serve_file(path, request)
+        except HTTPException:
+            raise
         except Exception as e:
             logging.error(f"[Uncracked] error in webhook: {e}")
             abort(500)
 
-    def serve_file(self, path):
+    def file_digest(self, file_path, st):
+        cached = self.digests.get(file_path)
+        if cached is not None and cached[0] == (st.st_size, st.st_mtime_ns):
+            return cached[1]
+        digest = hashlib.sha1()
+        with open(file_path, 'rb') as file_in:
+            for chunk in iter(lambda: file_in.read(ZIP_CHUNK_SIZE), b''):
+                digest.update(chunk)
+        self.digests[file_path] = ((st.st_size, st.st_mtime_ns), digest.hexdigest())
+        return digest.hexdigest()
+
+    def serve_file(self, path, request):
         dir = self.config['bettercap']['handshakes']
         try:
             logging.info(f"[Uncracked] serving {dir}/{path}")
-            response = send_from_directory(directory=dir, filename=path, as_attachment=True)
-            response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, max-age=0'
-            response.headers['Pragma'] = 'no-cache'
-            response.headers['Expires'] = '0'
-            return response
+            root = os.path.realpath(dir)
+            file_path = os.path.realpath(os.path.join(root, path))
+            if not file_path.startswith(root + os.sep) or not os.path.isfile(file_path):
+                raise FileNotFoundError(file_path)
+            return conditional_file_response(request, file_path, self.file_digest(file_path, os.stat(file_path)))
         except FileNotFoundError:
             logging.error(f"[Uncracked] file not found: {path}")
             abort(404)
+        except HTTPException:
+            raise
         except Exception as e:
             logging.error(f"[Uncracked] error serving file: {e}")
-            abort(500)
\ No newline at end of file
+            abort(500)